@@ -1,39 +1,201 @@
 from collections import defaultdict
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
+from content import ParsedContent, parse_content
+from dataclasses import dataclass
+from dedupe import FingerprintSet, content_key
 from datetime import datetime, timedelta, timezone
+from digested_posts import DigestedPostStore
+from domain_health import DomainHealth
+from enrichment import MetricsEnricher
+from instrumentation import run_metrics
+from functools import cached_property
 from mastodon import Mastodon
+from metrics_cache import MetricsCache
 from models import ScoredPost
-from typing import Optional
-import itertools
+from timeline_state import TimelineState, load_timeline_state, save_timeline_state
+from typing import Callable, Optional
+import html
 import re
-import requests
+import time
+
+# pages of favourites, bookmarks and boosts to check carried posts against, which reach back
+# further than the interactions since the last run of any frequently scheduled digest
+BOOTSTRAP_INTERACTION_PAGES = 5
+
+TAG_RE = re.compile(r"<[^>]*>")
+ANCHOR_TAG_RE = re.compile(r"<a\s[^>]*>", flags=re.IGNORECASE)
+ANCHOR_CLASS_RE = re.compile(r"""\bclass=["']([^"']*)["']""", flags=re.IGNORECASE)
+
+
+def has_non_mention_link(content: str) -> bool:
+    for tag in ANCHOR_TAG_RE.findall(content):
+        class_match = ANCHOR_CLASS_RE.search(tag)
+        if class_match is None or "mention" not in class_match.group(1).split():
+            return True
+    return False
+
+
+def post_content_key(post: dict, parsed_content: ParsedContent) -> str:
+    return content_key(
+        parsed_content.words,
+        [media.url for media in post.media_attachments],
+        [option.title for option in post.poll.options] if post.poll is not None else [],
+        [link.href for link in parsed_content.non_mention_links],
+    )
+
+
+def snowflake_id(at: datetime) -> int:
+    # the smallest status id Mastodon can give to a status created at that time
+    return int(at.timestamp() * 1000) << 16
+
+
+class LazyParsedContent:
+    """Parses the content of a post only when a filter needs it"""
+
+    def __init__(self, content: str) -> None:
+        self._content = content
+
+    @cached_property
+    def parsed(self) -> ParsedContent:
+        return parse_content(self._content)
+
+
+@dataclass(frozen=True)
+class PostFilter:
+    name: str
+    stat_name: Optional[str]
+    cost: int
+    excludes: Callable[[dict, LazyParsedContent], bool]
+
+
+class Bootstrap:
+    """Requests the account data a run needs before it can filter the timeline, all at once.
+
+    The requests don't depend on each other or on the timeline, so together with the first
+    page of the timeline they take about as long as the slowest one of them. Their results
+    are waited for when they are first needed, and raise the errors of the requests.
+    """
+
+    def __init__(
+        self,
+        mastodon_client: Mastodon,
+        config: Config,
+        boosted_list_ids: frozenset[int] = frozenset(),
+    ) -> None:
+        executor = ThreadPoolExecutor(
+            max_workers=min(5 + len(boosted_list_ids), 8), thread_name_prefix="bootstrap"
+        )
+        self._mastodon_client = mastodon_client
+        self._me = executor.submit(mastodon_client.me)
+        self._filters = executor.submit(mastodon_client.filters)
+        self._trending_statuses = (
+            executor.submit(mastodon_client.trending_statuses)
+            if config.timeline_exclude_trending
+            else None
+        )
+        self._list_accounts = [
+            executor.submit(mastodon_client.list_accounts, id, limit="0")
+            for id in boosted_list_ids
+        ]
+        # posts carried over from the last run are checked against what changed since
+        self._interacted_post_urls = (
+            executor.submit(self._fetch_interacted_post_urls)
+            if config.timeline_incremental
+            else None
+        )
+        self._muted_accts = (
+            executor.submit(self._fetch_muted_accts) if config.timeline_incremental else None
+        )
+        # the submitted requests still run, no new ones can be submitted
+        executor.shutdown(wait=False)
+
+    def me(self) -> dict:
+        return self._me.result()
+
+    def filters(self) -> list[dict]:
+        return self._filters.result()
+
+    def trending_statuses(self) -> list[dict]:
+        if self._trending_statuses is None:
+            return []
+        return self._trending_statuses.result()
+
+    def boosted_accounts(self) -> set[str]:
+        return set(
+            account.acct for accounts in self._list_accounts for account in accounts.result()
+        )
+
+    def interacted_post_urls(self) -> set[str]:
+        """The URLs of the posts the account recently favourited, bookmarked or boosted"""
+        if self._interacted_post_urls is None:
+            return set()
+        return self._interacted_post_urls.result()
+
+    def muted_accts(self) -> set[str]:
+        """The accounts and domains the account muted or blocked, as acct and @domain"""
+        if self._muted_accts is None:
+            return set()
+        return self._muted_accts.result()
+
+    def _fetch_pages(self, page: Optional[list], max_pages: int) -> list:
+        items = []
+        while page and max_pages > 0:
+            items.extend(page)
+            page = self._mastodon_client.fetch_next(page)
+            max_pages -= 1
+        return items
+
+    def _fetch_interacted_post_urls(self) -> set[str]:
+        client = self._mastodon_client
+        pages = BOOTSTRAP_INTERACTION_PAGES
+        statuses = self._fetch_pages(client.favourites(limit=40), pages)
+        statuses += self._fetch_pages(client.bookmarks(limit=40), pages)
+        own_statuses = self._fetch_pages(
+            client.account_statuses(self._me.result().id, limit=40), pages
+        )
+        # the boosts of the account are its statuses with the boosted post as reblog
+        statuses += [status.reblog for status in own_statuses if status.reblog is not None]
+        return set(status.url for status in statuses)
+
+    def _fetch_muted_accts(self) -> set[str]:
+        client = self._mastodon_client
+        accounts = client.fetch_remaining(client.mutes(limit=80))
+        accounts += client.fetch_remaining(client.blocks(limit=80))
+        domains = client.fetch_remaining(client.domain_blocks(limit=200))
+        return set(account.acct for account in accounts) | set("@" + domain for domain in domains)
 
 
 class PostFilterator:
     def __init__(
         self,
-        digested_post_urls: set[str],
+        digested_post_urls: DigestedPostStore,
         mastodon_client: Mastodon,
         config: Config,
+        bootstrap: Optional[Bootstrap] = None,
     ) -> None:
-        self._seen_post_urls = set()
+        bootstrap = bootstrap or Bootstrap(mastodon_client, config)
+        self._seen_post_urls = FingerprintSet()
         self._mastodon_client = mastodon_client
         self._config = config
         self._stats = defaultdict(int)
-        self._mastodon_user = mastodon_client.me()
-        self._server_filters = self._get_server_filter_as_regex()
-        self._trending_post_ids = self._get_trending_post_ids()
+        self._mastodon_user = bootstrap.me()
+        self._server_filters = self._get_server_filter_as_regex(bootstrap.filters())
+        self._trending_post_ids = set(p.id for p in bootstrap.trending_statuses())
+        self._bootstrap = bootstrap
         self._digested_post_urls = digested_post_urls
         self._min_post_created_at = datetime.now(timezone.utc) - timedelta(
             hours=config.post_max_age_hours
         )
-        self._contents = set()
+        # content keys of the accepted posts, to catch the same post made by many accounts
+        self._contents = FingerprintSet()
+        self._filters = self._get_filters()
+        self._filter_timings = defaultdict(float)
+        self._filter_counts = defaultdict(int)
 
         print(f"Fetching data for {self._mastodon_user.username}")
 
-    def _get_server_filter_as_regex(self) -> Optional[re.Pattern[str]]:
-        filters = self._mastodon_client.filters()
+    def _get_server_filter_as_regex(self, filters: list[dict]) -> Optional[re.Pattern[str]]:
         if filters:
             filter_strings = []
             for keyword_filter in filters:
@@ -50,28 +212,14 @@ class PostFilterator:
             return re.compile("|".join(filter_strings), flags=re.IGNORECASE)
         return None
 
-    def _get_trending_post_ids(self) -> set[int]:
-        if self._config.timeline_exclude_trending:
-            return set(p.id for p in self._mastodon_client.trending_statuses())
-        return set()
-
-    def _is_short_post(self, post: dict, soup: BeautifulSoup) -> bool:
-        words = [
-            word
-            for word in soup.text.split()
-            if not (word.startswith("#") or word.startswith("@") or word.startswith("http"))
-        ]
+    def _is_short_post(self, post: dict, parsed_content: ParsedContent) -> bool:
+        words = parsed_content.words
 
         return (len(words) == 0) or (
             len(words) <= self._config.post_min_word_count
             and len(post.media_attachments) == 0
             and post.poll is None
-            and len(
-                soup.find_all(
-                    lambda tag: tag.name == "a" and "mention" not in tag.attrs.get("class", [])
-                )
-            )
-            == 0
+            and len(parsed_content.non_mention_links) == 0
         )
 
     def _is_valid_lang_post(self, post: dict) -> bool:
@@ -91,158 +239,283 @@ class PostFilterator:
     def add_seen_post_url(self, url: str) -> None:
         self._seen_post_urls.add(url)
 
-    def filter_posts(self, posts: list[dict]) -> tuple[list[dict], set[str]]:
+    def _is_seen_post(self, post: dict, content: LazyParsedContent) -> bool:
+        return post.url in self._seen_post_urls
+
+    def _is_digested_post(self, post: dict, content: LazyParsedContent) -> bool:
+        return (
+            self._config.timeline_exclude_previously_digested_posts
+            and post.url in self._digested_post_urls
+        )
+
+    def _is_direct_post(self, post: dict, content: LazyParsedContent) -> bool:
+        return post.visibility == "direct"
+
+    def _is_muted_post(self, post: dict, content: LazyParsedContent) -> bool:
+        return post.muted
+
+    def _is_old_post(self, post: dict, content: LazyParsedContent) -> bool:
+        return post.created_at < self._min_post_created_at
+
+    def _is_trending_post(self, post: dict, content: LazyParsedContent) -> bool:
+        return self._config.timeline_exclude_trending and post.id in self._trending_post_ids
+
+    def _is_duplicate_post(self, post: dict, content: LazyParsedContent) -> bool:
+        return post_content_key(post, content.parsed) in self._contents
+
+    def _is_foreign_language_post(self, post: dict, content: LazyParsedContent) -> bool:
+        return not self._is_valid_lang_post(post)
+
+    def _is_server_filtered_post(self, post: dict, content: LazyParsedContent) -> bool:
+        return any(
+            "home" in f.filter.context and f.filter.filter_action == "hide"
+            for f in post.filtered
+        )
+
+    def _is_surely_short_post(self, post: dict, content: LazyParsedContent) -> bool:
+        # the raw content has at least as many words as its parsed text
+        max_word_count = len(html.unescape(TAG_RE.sub(" ", post.content)).split())
+        return max_word_count == 0 or (
+            max_word_count <= self._config.post_min_word_count
+            and len(post.media_attachments) == 0
+            and post.poll is None
+            and not has_non_mention_link(post.content)
+        )
+
+    def _is_parsed_short_post(self, post: dict, content: LazyParsedContent) -> bool:
+        return self._is_short_post(post, content.parsed)
+
+    def _is_client_filtered_post(self, post: dict, content: LazyParsedContent) -> bool:
+        server_filters = self._server_filters
+        return server_filters is not None and (
+            server_filters.search(content.parsed.text) is not None
+            or server_filters.search(post.spoiler_text) is not None
+            or any(
+                media.description is not None
+                and server_filters.search(media.description) is not None
+                for media in post.media_attachments
+            )
+        )
+
+    def _get_filters(self) -> list[PostFilter]:
+        filters = [
+            PostFilter("seen", None, 0, self._is_seen_post),
+            PostFilter("digested", "digested_post_count", 0, self._is_digested_post),
+            PostFilter("direct", "direct_post_count", 0, self._is_direct_post),
+            PostFilter("muted", "muted_post_count", 0, self._is_muted_post),
+            PostFilter(
+                "interacted",
+                "interacted_post_count",
+                0,
+                lambda post, content: self._is_interacted_post(post),
+            ),
+            PostFilter("old", "old_post_count", 0, self._is_old_post),
+            PostFilter("trending", "trending_post_count", 0, self._is_trending_post),
+            PostFilter(
+                "foreign_language", "foreign_language_post_count", 0, self._is_foreign_language_post
+            ),
+            PostFilter("server_filtered", "filtered_post_count", 1, self._is_server_filtered_post),
+            PostFilter("surely_short", "short_post_count", 2, self._is_surely_short_post),
+            # the filters below parse the content
+            PostFilter("short", "short_post_count", 10, self._is_parsed_short_post),
+            PostFilter("client_filtered", "filtered_post_count", 11, self._is_client_filtered_post),
+            PostFilter("duplicate", "duplicate_post_count", 12, self._is_duplicate_post),
+        ]
+        # cheap filters run first so that fewer posts reach the expensive ones
+        return sorted(filters, key=lambda f: f.cost)
+
+    def filter_posts(self, posts: list[dict]) -> tuple[list[ScoredPost], set[str]]:
         filtered_posts = []
         boost_posts_urls = set()
         for post in posts:
+            timeline_at = post.created_at
             boost = False
             if post.reblog is not None:
                 post = post.reblog  # look at the boosted post
                 boost = True
 
-            if post.url in self._seen_post_urls:
-                # print(f"Excluded seen post {post.url}")
-                continue
-
-            if (
-                self._config.timeline_exclude_previously_digested_posts
-                and post.url in self._digested_post_urls
-            ):
-                # print(f"Excluded seen post {post.url}")
-                self._stats["digested_post_count"] += 1
-                continue
-
-            if post.visibility == "direct":
-                # print(f"Excluded direct post {post.url}")
-                self._stats["direct_post_count"] += 1
-                continue
-
-            if post.muted:
-                # print(f"Excluded muted post {post.url}")
-                self._stats["muted_post_count"] += 1
-                continue
-
-            if self._is_interacted_post(post):
-                # print(f"Excluded interacted post {post.url}")
-                self._stats["interacted_post_count"] += 1
+            content = LazyParsedContent(post.content)
+            excluded = False
+            for post_filter in self._filters:
+                started_at = time.perf_counter()
+                excluded = post_filter.excludes(post, content)
+                self._filter_timings[post_filter.name] += time.perf_counter() - started_at
+                self._filter_counts[post_filter.name] += 1
+                if excluded:
+                    # print(f"Excluded {post_filter.name} post {post.url}")
+                    if post_filter.stat_name is not None:
+                        self._stats[post_filter.stat_name] += 1
+                    break
+            if excluded:
                 continue
 
-            if post.created_at < self._min_post_created_at:
-                # print(f"Excluded old post {post.url}")
-                self._stats["old_post_count"] += 1
-                continue
-
-            if self._config.timeline_exclude_trending and post.id in self._trending_post_ids:
-                # print(f"Excluded trending post {post.url}")
-                self._stats["trending_post_count"] += 1
-                continue
+            content_fingerprint = self._contents.add(post_content_key(post, content.parsed))
+            # the parsed content is kept for the formatters
+            scored_post = ScoredPost(
+                post, content.parsed, timeline_at, self._config.post_min_word_count
+            )
+            scored_post.content_fingerprint = content_fingerprint
+            filtered_posts.append(scored_post)
+            if boost:
+                boost_posts_urls.add(post.url)
 
-            if post.content in self._contents:
-                # print(f"Excluded duplicate post {post.url}")
-                self._stats["duplicate_post_count"] += 1
-                continue
+        return (filtered_posts, boost_posts_urls)
 
-            if not self._is_valid_lang_post(post):
-                # print(f"Excluded foreign language post {post.url}")
-                self._stats["foreign_language_post_count"] += 1
-                continue
+    def filter_carried_posts(
+        self, posts: list[ScoredPost], min_timeline_at: datetime
+    ) -> list[ScoredPost]:
+        """Filters the posts kept from the last run that don't belong in this run anymore.
+
+        They pass the filters that a post can stop passing since: the account may have
+        interacted with it, muted its author, or added filters, and it may be trending now.
+        """
+        interacted_post_urls = self._bootstrap.interacted_post_urls()
+        muted_accts = self._bootstrap.muted_accts()
+        carried_filters = [
+            f
+            for f in self._filters
+            if f.name in ("digested", "direct", "old", "trending", "client_filtered")
+        ] + [
+            PostFilter(
+                "interacted",
+                "interacted_post_count",
+                0,
+                lambda post, content: post.url in interacted_post_urls,
+            ),
+            PostFilter(
+                "muted",
+                "muted_post_count",
+                0,
+                lambda post, content: post.account.acct in muted_accts
+                or "@" + post.account.acct.partition("@")[2] in muted_accts,
+            ),
+        ]
 
-            soup = BeautifulSoup(post.content, "html.parser")
-            if self._is_short_post(post, soup):
-                # print(f"Excluded short post {post.url}")
-                self._stats["short_post_count"] += 1
+        carried_posts = []
+        for post in posts:
+            if post.timeline_at < min_timeline_at:
+                self._stats["expired_carried_post_count"] += 1
                 continue
 
-            if any(
-                "home" in f.filter.context and f.filter.filter_action == "hide"
-                for f in post.filtered
-            ):
-                # print(f"Excluded post matching user's filters on server side {post.url}")
-                self._stats["filtered_post_count"] += 1
+            content = LazyParsedContent(post.content)
+            excluded_by = next((f for f in carried_filters if f.excludes(post, content)), None)
+            if excluded_by is not None:
+                if excluded_by.stat_name is not None:
+                    self._stats[excluded_by.stat_name] += 1
                 continue
 
-            content_text = soup.get_text(" ", strip=True)
-            server_filters = self._server_filters
-            if server_filters is not None:
-                if (
-                    server_filters.search(content_text) is not None
-                    or server_filters.search(post.spoiler_text) is not None
-                    or any(
-                        media.description is not None
-                        and server_filters.search(media.description) is not None
-                        for media in post.media_attachments
-                    )
-                ):
-                    # print(f"Excluded post matching user's filters on client side {post.url}")
-                    self._stats["filtered_post_count"] += 1
-                    continue
-
-            filtered_posts.append(post)
-            if boost:
-                boost_posts_urls.add(post.url)
+            carried_posts.append(post)
+            self.add_seen_post_url(post.url)
+            # so that new copies of carried posts are excluded like in a full run
+            if post.content_fingerprint is not None:
+                self._contents.add_fingerprint(post.content_fingerprint)
 
-        return (filtered_posts, boost_posts_urls)
+        return carried_posts
 
     def print_stats(self):
         print(f"Excluded {sum(self._stats.values())} posts:")
         for key, val in self._stats.items():
             print(f"    {key} = {self._stats[key]}")
+        print(f"Filter timings:")
+        for post_filter in self._filters:
+            name = post_filter.name
+            print(
+                f"    {name} = {self._filter_timings[name] * 1000:.1f}ms "
+                f"for {self._filter_counts[name]} posts"
+            )
+        print(f"Dedupe memory:")
+        print(
+            f"    seen_post_urls = {len(self._seen_post_urls)} fingerprints in "
+            f"{self._seen_post_urls.memory_bytes() / 1024:.0f}KB"
+        )
+        print(
+            f"    contents = {len(self._contents)} fingerprints in "
+            f"{self._contents.memory_bytes() / 1024:.0f}KB"
+        )
 
 
 def fetch_posts_and_boosts(
-    digested_post_urls: set[str], mastodon_client: Mastodon, config: Config
+    digested_post_urls: DigestedPostStore,
+    mastodon_client: Mastodon,
+    domain_health: DomainHealth,
+    metrics_cache: MetricsCache,
+    config: Config,
+    bootstrap: Optional[Bootstrap] = None,
 ) -> tuple[list[ScoredPost], list[ScoredPost]]:
-    """Fetches posts form the home timeline that the account hasn't interacted with"""
+    """Fetches posts form the home timeline that the account hasn't interacted with.
+
+    In incremental mode, only the part of the timeline newer than what the last run saw is
+    fetched, and merged with the posts of the last run that are still within the window.
+    The first page of the timeline is fetched while waiting for the `bootstrap` requests.
+    """
     start = datetime.now(timezone.utc) - timedelta(hours=config.timeline_hours_limit)
     posts: list[ScoredPost] = []
     boosts: list[ScoredPost] = []
     total_posts_seen = 0
-    filterator = PostFilterator(digested_post_urls, mastodon_client, config)
+
+    min_id = start
+    state = TimelineState()
+    if config.timeline_incremental:
+        state = load_timeline_state(config)
+        # a checkpoint older than the window would page in posts from before the window
+        if state.newest_status_id is not None and state.newest_status_id > snowflake_id(start):
+            min_id = state.newest_status_id
 
     # Iterate over our home timeline until we run out of posts or we hit the limit
-    response: Optional[list[dict]] = mastodon_client.timeline(min_id=start, limit=40)
-    while response and total_posts_seen < config.timeline_posts_limit:
-        print("Fetched timeline posts")
-        resp_posts, boost_posts_urls = filterator.filter_posts(response)
-
-        for post in resp_posts:
-            scored_post = ScoredPost(post)  # wrap the post data as a ScoredPost
-            total_posts_seen += 1
-            # Append to either the boosts list or the posts lists
-            if post.url in boost_posts_urls:
-                boosts.append(scored_post)
-            else:
-                posts.append(scored_post)
-            filterator.add_seen_post_url(scored_post.url)
-
-        # fetch the previous (because of reverse chron) page of results
-        response = mastodon_client.fetch_previous(response)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="timeline") as page_fetcher:
+        first_response = page_fetcher.submit(mastodon_client.timeline, min_id=min_id, limit=40)
+        with run_metrics.stage("bootstrap"):
+            bootstrap = bootstrap or Bootstrap(mastodon_client, config)
+            filterator = PostFilterator(digested_post_urls, mastodon_client, config, bootstrap)
+        # enrichment of the posts of a page runs while the next pages are fetched and filtered
+        enricher = MetricsEnricher(config, domain_health, metrics_cache)
+
+        if config.timeline_incremental:
+            posts = filterator.filter_carried_posts(state.posts, start)
+            boosts = filterator.filter_carried_posts(state.boosts, start)
+            total_posts_seen = len(posts) + len(boosts)
+            print(f"Kept {total_posts_seen} posts from the last run")
+            # metrics of kept posts are refreshed when their cache entries expire
+            enricher.submit(posts + boosts)
+
+        with run_metrics.stage("timeline"):
+            response: Optional[list[dict]] = first_response.result()
+        while response and total_posts_seen < config.timeline_posts_limit:
+            print("Fetched timeline posts")
+            run_metrics.add_count("timeline_statuses", len(response))
+            status_ids = [status.id for status in response]
+            if state.newest_status_id is not None:
+                status_ids.append(state.newest_status_id)
+            state.newest_status_id = max(status_ids)
+            # fetch the previous (because of reverse chron) page of results in the background
+            next_response = page_fetcher.submit(mastodon_client.fetch_previous, response)
+            with run_metrics.stage("filter"):
+                resp_posts, boost_posts_urls = filterator.filter_posts(response)
+
+            for scored_post in resp_posts:
+                total_posts_seen += 1
+                # Append to either the boosts list or the posts lists
+                if scored_post.url in boost_posts_urls:
+                    boosts.append(scored_post)
+                else:
+                    posts.append(scored_post)
+                filterator.add_seen_post_url(scored_post.url)
+            enricher.submit(resp_posts)
+
+            # only the time spent waiting for the page counts, the fetch overlaps with filtering
+            with run_metrics.stage("timeline"):
+                response = next_response.result()
 
     filterator.print_stats()
 
-    total_count = len(posts) + len(boosts)
-    for i, scored_post in enumerate(itertools.chain(posts, boosts)):
-        if scored_post.fetch_metrics():
-            print(f"[{i+1}/{total_count}] Fetched metrics for {scored_post.url}")
+    # enrichment overlaps with paging, so this is only the time spent waiting for the rest
+    with run_metrics.stage("enrichment"):
+        enricher.finish()
+    enricher.print_stats()
 
-    return posts, boosts
-
-
-def fetch_boosted_accounts(mastodon_client: Mastodon, boosted_lists: set[int]) -> set[str]:
-    boosted_accounts: list[str] = []
-    for id in boosted_lists:
-        accounts = mastodon_client.list_accounts(id, limit="0")
-        boosted_accounts.extend(account.acct for account in accounts)
+    if config.timeline_incremental:
+        state.posts = posts
+        state.boosts = boosts
+        save_timeline_state(state, config)
 
-    return set(boosted_accounts)
-
-
-def get_known_instance_domains() -> set[str]:
-    try:
-        with requests.get("https://nodes.fediverse.party/nodes.json") as resp:
-            domains = resp.json()
-            assert type(domains) == list
-            return set("://" + domain + "/" for domain in domains)
-    except requests.exceptions.RequestException as err:
-        print("Error in getting fediverse nodes.json", err)
-        return set()
+    return posts, boosts
@@ -0,0 +1,151 @@
+from concurrent.futures import ThreadPoolExecutor
+from config import Config, read_config
+from dataclasses import dataclass
+from domain_health import DomainHealth
+from known_instances import prefetch_known_instance_domains
+from metrics_cache import MetricsCache
+from models import ScoredPost
+from pathlib import Path
+from run import add_profile_arguments, build_digest, profiling, write_run_metrics
+from scorers import ExtendedSimpleWeightedScorer
+import argparse
+import os
+import sys
+import time
+import tomllib
+import traceback
+
+
+@dataclass
+class Account:
+    name: str
+    config: Config
+    mastodon_base_url: str
+    mastodon_token: str
+    output_dir: Path
+
+
+def read_accounts(path: str) -> list[Account]:
+    """Reads the accounts to build digests for from a TOML file like:
+
+        [[accounts]]
+        name = "alice"
+        config = "alice.toml"
+        output = "render/alice/"
+        mastodon_base_url = "https://mastodon.social"
+        mastodon_token_env = "ALICE_MASTODON_TOKEN"
+
+    Tokens are read from the named environment variables, so they don't end up in files.
+    """
+    with open(path, "rb") as f:
+        batch = tomllib.load(f)
+
+    accounts = []
+    for entry in batch.get("accounts", []):
+        name = entry["name"]
+        token = os.getenv(entry["mastodon_token_env"])
+        if not token:
+            sys.exit(f"Missing environment variable for {name}: {entry['mastodon_token_env']}")
+
+        output_dir = Path(entry["output"])
+        if not output_dir.exists() or not output_dir.is_dir():
+            sys.exit(f"Output directory for {name} not found: {output_dir}")
+
+        accounts.append(
+            Account(
+                name=name,
+                config=read_config(entry["config"]),
+                mastodon_base_url=entry["mastodon_base_url"],
+                mastodon_token=token,
+                output_dir=output_dir,
+            )
+        )
+
+    if not accounts:
+        sys.exit(f"No accounts in: {path}")
+
+    # these files belong to one account, and concurrent runs must not share them
+    for field in ("digest_digested_posts_file", "timeline_state_file"):
+        paths = [getattr(account.config, field) for account in accounts]
+        if len(set(paths)) != len(paths):
+            sys.exit(f"Every account needs its own {field}")
+
+    return accounts
+
+
+def run_batch(accounts: list[Account], workers: int) -> None:
+    """Builds the digests of many accounts at the same time.
+
+    The digests share the domain health, the metrics cache and the run report, configured
+    by the config of the first account, as well as the known instance domains and the
+    Mastodon clients of remote instances. So a post that shows up in many timelines is
+    fetched once, and an instance is probed once.
+    """
+    ScoredPost.configure_remote_session(accounts[0].config)
+    known_instance_domains = prefetch_known_instance_domains(accounts[0].config)
+    domain_health = DomainHealth(accounts[0].config)
+    domain_health.load()
+    metrics_cache = MetricsCache(accounts[0].config)
+    scorer = ExtendedSimpleWeightedScorer()
+
+    def run_account(account: Account) -> bool:
+        print(f"Building digest for {account.name}")
+        started_at = time.monotonic()
+        try:
+            build_digest(
+                account.config,
+                scorer,
+                account.mastodon_token,
+                account.mastodon_base_url,
+                account.output_dir,
+                domain_health,
+                metrics_cache,
+                known_instance_domains,
+            )
+        except Exception:
+            print(f"Failed to build digest for {account.name}")
+            traceback.print_exc()
+            return False
+
+        print(f"Built digest for {account.name} in {time.monotonic() - started_at:.1f}s")
+        return True
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+            results = list(executor.map(run_account, accounts))
+    finally:
+        metrics_cache.close()
+        domain_health.save()
+    metrics_cache.print_stats()
+    domain_health.print_stats()
+    write_run_metrics(accounts[0].config)
+
+    failed = [account.name for account, ok in zip(accounts, results) if not ok]
+    print(f"Built {len(accounts) - len(failed)} of {len(accounts)} digests")
+    if failed:
+        sys.exit(f"Failed to build digests for: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog="mastodon_digest_batch",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument(
+        "accounts",
+        help="The path to the TOML file listing the accounts",
+        type=str,
+    )
+    arg_parser.add_argument(
+        "--workers",
+        default=4,
+        dest="workers",
+        help="The number of digests to build at the same time",
+        type=int,
+    )
+    add_profile_arguments(arg_parser)
+
+    args = arg_parser.parse_args()
+    accounts = read_accounts(args.accounts)
+    with profiling(args):
+        run_batch(accounts, args.workers)
@@ -0,0 +1,172 @@
+"""A local stand-in for Mastodon instances that Mastodon.py can talk to.
+
+Every instance listens on its own port of 127.0.0.1, so that posts of different instances
+have different origin URLs, and can be made slow with an injected latency. Serves only the
+endpoints the digest uses, and counts the requests it gets.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+import json
+import re
+import threading
+import time
+
+STATUS_PATH_RE = re.compile(r"^/api/v1/statuses/(\d+)$")
+LIST_ACCOUNTS_PATH_RE = re.compile(r"^/api/v1/lists/\d+/accounts$")
+ACCOUNT_STATUSES_PATH_RE = re.compile(r"^/api/v1/accounts/\d+/statuses$")
+# the account didn't interact with, mute or block anything
+EMPTY_LIST_PATHS = {
+    "/api/v1/favourites": "favourites",
+    "/api/v1/bookmarks": "bookmarks",
+    "/api/v1/mutes": "mutes",
+    "/api/v1/blocks": "blocks",
+    "/api/v1/domain_blocks": "domain_blocks",
+}
+
+
+def _to_json(value) -> bytes:
+    def default(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        raise TypeError(f"Can't serialize {type(value)}")
+
+    return json.dumps(value, default=default).encode()
+
+
+class FakeMastodonInstance:
+    def __init__(self, latency_ms: int = 0) -> None:
+        self.latency = latency_ms / 1000
+        self.statuses: dict[int, dict] = {}
+        # oldest first, only on the home instance
+        self._home_timeline: list[dict] = []
+        self._home_timeline_ids: list[int] = []
+        self.me: Optional[dict] = None
+        self.request_counts: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def domain(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.domain}"
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def home_timeline(self) -> list[dict]:
+        return self._home_timeline
+
+    def set_home_timeline(self, statuses: list[dict]) -> None:
+        self._home_timeline = sorted(statuses, key=lambda status: status["id"])
+        self._home_timeline_ids = [status["id"] for status in self._home_timeline]
+
+    def _count(self, endpoint: str) -> None:
+        with self._lock:
+            self.request_counts[endpoint] += 1
+
+    def _timeline_page(self, query: dict) -> tuple[list[dict], Optional[str]]:
+        limit = min(int(query.get("limit", ["20"])[0]), 40)
+        max_id = int(query["max_id"][0]) if "max_id" in query else None
+        min_id = int(query["min_id"][0]) if "min_id" in query else None
+        start = 0 if min_id is None else bisect_right(self._home_timeline_ids, min_id)
+        end = len(self._home_timeline_ids)
+        if max_id is not None:
+            end = bisect_left(self._home_timeline_ids, max_id)
+        # min_id pages are the oldest statuses after it, others the newest before max_id
+        if min_id is not None:
+            page = self._home_timeline[start : min(start + limit, end)]
+        else:
+            page = self._home_timeline[max(end - limit, start) : end]
+        page = list(reversed(page))
+        if not page:
+            return page, None
+
+        path = f"{self.base_url}/api/v1/timelines/home"
+        link = (
+            f'<{path}?limit={limit}&max_id={page[-1]["id"]}>; rel="next", '
+            f'<{path}?limit={limit}&min_id={page[0]["id"]}>; rel="prev"'
+        )
+        return page, link
+
+    def _make_handler(self) -> type[BaseHTTPRequestHandler]:
+        instance = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+            def _send(self, status: int, body: bytes = b"", headers: dict = {}) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_HEAD(self) -> None:
+                instance._count("HEAD")
+                time.sleep(instance.latency)
+                self._send(404)
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                path = url.path.rstrip("/")
+                query = parse_qs(url.query)
+                time.sleep(instance.latency)
+
+                if path == "/api/v1/instance":
+                    instance._count("instance")
+                    self._send(200, _to_json({"uri": instance.domain, "version": "4.2.0"}))
+                elif path == "/api/v1/accounts/verify_credentials":
+                    instance._count("verify_credentials")
+                    self._send(200, _to_json(instance.me))
+                elif path == "/api/v1/filters":
+                    instance._count("filters")
+                    self._send(200, b"[]")
+                elif path == "/api/v1/trends/statuses":
+                    instance._count("trends")
+                    self._send(200, b"[]")
+                elif path in EMPTY_LIST_PATHS:
+                    instance._count(EMPTY_LIST_PATHS[path])
+                    self._send(200, b"[]")
+                elif ACCOUNT_STATUSES_PATH_RE.match(path):
+                    instance._count("account_statuses")
+                    self._send(200, b"[]")
+                elif LIST_ACCOUNTS_PATH_RE.match(path):
+                    instance._count("list_accounts")
+                    self._send(200, b"[]")
+                elif path == "/api/v1/timelines/home":
+                    instance._count("timeline")
+                    page, link = instance._timeline_page(query)
+                    self._send(200, _to_json(page), {"Link": link} if link else {})
+                elif match := STATUS_PATH_RE.match(path):
+                    instance._count("status")
+                    status = instance.statuses.get(int(match.group(1)))
+                    if status is None:
+                        self._send(404, b'{"error": "Record not found"}')
+                    else:
+                        self._send(200, _to_json(status))
+                else:
+                    instance._count("unknown")
+                    self._send(404, b'{"error": "Not found"}')
+
+        return Handler
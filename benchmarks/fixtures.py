@@ -0,0 +1,218 @@
+"""Synthetic Mastodon API payloads for the benchmarks"""
+
+from datetime import datetime, timedelta, timezone
+from mastodon.utility import AttribAccessDict
+import random
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog mastodon fediverse instance post timeline "
+    "boost favourite reply thread digest score compiler haskell running astronomy"
+).split()
+
+
+def to_attrib_access_dict(value):
+    if isinstance(value, dict):
+        return AttribAccessDict({k: to_attrib_access_dict(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [to_attrib_access_dict(v) for v in value]
+    return value
+
+
+def make_account(account_id: int, domain: str, scheme: str = "https") -> dict:
+    username = f"user{account_id}"
+    return {
+        "id": account_id,
+        "username": username,
+        "acct": f"{username}@{domain}",
+        "display_name": f"User {account_id} :blobcat:",
+        "locked": False,
+        "bot": random.random() < 0.05,
+        "discoverable": True,
+        "group": False,
+        "created_at": datetime(2022, 11, 1, tzinfo=timezone.utc),
+        "note": "<p>" + " ".join(random.choices(WORDS, k=40)) + "</p>",
+        "url": f"{scheme}://{domain}/@{username}",
+        "avatar": f"{scheme}://{domain}/avatars/{account_id}.png",
+        "avatar_static": f"{scheme}://{domain}/avatars/{account_id}.png",
+        "header": f"{scheme}://{domain}/headers/{account_id}.png",
+        "header_static": f"{scheme}://{domain}/headers/{account_id}.png",
+        "followers_count": random.randint(0, 50000),
+        "following_count": random.randint(0, 2000),
+        "statuses_count": random.randint(0, 20000),
+        "last_status_at": datetime(2024, 1, 1, tzinfo=timezone.utc),
+        "emojis": [
+            {
+                "shortcode": "blobcat",
+                "url": f"{scheme}://{domain}/emoji/blobcat.png",
+                "static_url": f"{scheme}://{domain}/emoji/blobcat.png",
+                "visible_in_picker": True,
+            }
+        ],
+        "fields": [
+            {"name": "Website", "value": f"<a href=\"{scheme}://{domain}\">{domain}</a>"},
+            {"name": "Pronouns", "value": "they/them"},
+        ],
+    }
+
+
+def make_status(
+    status_id: int,
+    account: dict,
+    domain: str,
+    created_at: datetime,
+    in_reply_to_id: int = None,
+    scheme: str = "https",
+) -> dict:
+    words = random.choices(WORDS, k=random.randint(5, 80))
+    tags = random.sample(WORDS, k=random.randint(0, 4))
+    media_count = random.choice([0, 0, 0, 1, 2])
+    content = (
+        '<p><span class="h-card"><a href="https://example.social/@friend" '
+        'class="u-url mention">@<span>friend</span></a></span> '
+        + " ".join(words)
+        + " "
+        + " ".join(
+            f'<a href="{scheme}://{domain}/tags/{t}" class="mention hashtag">#{t}</a>' for t in tags
+        )
+        + ' <a href="https://news.example.com/article" rel="nofollow">link</a></p>'
+    )
+    return {
+        "id": status_id,
+        "uri": f"{scheme}://{domain}/users/{account['username']}/statuses/{status_id}",
+        "url": f"{scheme}://{domain}/@{account['username']}/{status_id}",
+        "created_at": created_at,
+        "account": account,
+        "content": content,
+        "visibility": "public",
+        "sensitive": False,
+        "spoiler_text": "",
+        "media_attachments": [
+            {
+                "id": status_id * 10 + i,
+                "type": "image",
+                "url": f"{scheme}://{domain}/media/{status_id}/{i}.png",
+                "preview_url": f"{scheme}://{domain}/media/{status_id}/{i}_small.png",
+                "remote_url": None,
+                "description": " ".join(random.choices(WORDS, k=12)),
+                "blurhash": "UeKUpFxuo~R%0nW;WCnhF6RjaJt757oJodS$",
+                "meta": {
+                    "original": {"width": 1200, "height": 800, "size": "1200x800", "aspect": 1.5},
+                    "small": {"width": 400, "height": 267, "size": "400x267", "aspect": 1.5},
+                },
+            }
+            for i in range(media_count)
+        ],
+        "application": {"name": "Web", "website": None},
+        "mentions": [
+            {
+                "id": 1,
+                "username": "friend",
+                "url": "https://example.social/@friend",
+                "acct": "friend@example.social",
+            }
+        ],
+        "tags": [{"name": t, "url": f"{scheme}://{domain}/tags/{t}"} for t in tags],
+        "emojis": [],
+        "reblogs_count": random.randint(0, 200),
+        "favourites_count": random.randint(0, 500),
+        "replies_count": random.randint(0, 50),
+        "in_reply_to_id": in_reply_to_id,
+        "in_reply_to_account_id": None,
+        "reblog": None,
+        "poll": None,
+        "card": {
+            "url": "https://news.example.com/article",
+            "title": "An article",
+            "description": " ".join(random.choices(WORDS, k=30)),
+            "type": "link",
+            "image": "https://news.example.com/article.png",
+        },
+        "language": "en",
+        "text": None,
+        "edited_at": None,
+        "favourited": False,
+        "reblogged": False,
+        "muted": False,
+        "bookmarked": False,
+        "pinned": False,
+        "filtered": [],
+    }
+
+
+def make_statuses(count: int, domain_count: int = 50, hours: int = 24) -> list[dict]:
+    now = datetime.now(timezone.utc)
+    domains = [f"instance{i}.example" for i in range(domain_count)]
+    accounts = [make_account(i, random.choice(domains)) for i in range(max(count // 5, 1))]
+    statuses = []
+    for status_id in range(1, count + 1):
+        account = random.choice(accounts)
+        domain = account["acct"].split("@")[1]
+        created_at = now - timedelta(seconds=random.randint(0, hours * 60 * 60))
+        statuses.append(make_status(status_id, account, domain, created_at))
+    return [to_attrib_access_dict(status) for status in statuses]
+
+
+def snowflake_id(created_at: datetime, sequence: int) -> int:
+    # Mastodon ids are milliseconds since the epoch shifted left by 16 bits, which is what
+    # Mastodon.py turns datetimes into for min_id and max_id
+    return (int(created_at.timestamp() * 1000) << 16) + (sequence & 0xFFFF)
+
+
+def make_timeline(
+    count: int,
+    home_domain: str,
+    remote_domains: list[str],
+    hours: int = 24,
+    reply_depth: int = 3,
+    boost_ratio: float = 0.2,
+    scheme: str = "https",
+) -> list[dict]:
+    """A home timeline of `count` plain status dicts, oldest first, with reply chains of up to
+    `reply_depth` replies and `boost_ratio` of the entries being boosts by home accounts"""
+    now = datetime.now(timezone.utc)
+    authors = [
+        make_account(i, random.choice(remote_domains), scheme) for i in range(max(count // 5, 1))
+    ]
+    boosters = [make_account(100000 + i, home_domain, scheme) for i in range(max(count // 50, 1))]
+    created_ats = sorted(
+        now - timedelta(seconds=random.randint(60, hours * 60 * 60)) for _ in range(count)
+    )
+
+    timeline = []
+    depths: dict[int, int] = {}
+    recent: list[dict] = []
+    for sequence, created_at in enumerate(created_ats):
+        status_id = snowflake_id(created_at, sequence)
+        replied = None
+        if reply_depth > 0 and recent and random.random() < 0.3:
+            replied = random.choice(recent)
+            if depths[replied["id"]] >= reply_depth:
+                replied = None
+
+        account = random.choice(authors)
+        domain = account["acct"].split("@")[1]
+        status = make_status(
+            status_id,
+            account,
+            domain,
+            created_at,
+            replied["id"] if replied is not None else None,
+            scheme,
+        )
+        if replied is not None:
+            status["in_reply_to_account_id"] = replied["account"]["id"]
+        depths[status_id] = depths[replied["id"]] + 1 if replied is not None else 0
+        recent = (recent + [status])[-50:]
+
+        if random.random() < boost_ratio:
+            booster = random.choice(boosters)
+            boosted_at = min(created_at + timedelta(seconds=random.randint(1, 600)), now)
+            boost_id = snowflake_id(boosted_at, sequence + count)
+            timeline.append(
+                make_status(boost_id, booster, home_domain, boosted_at, scheme=scheme)
+                | {"reblog": status, "content": ""}
+            )
+        else:
+            timeline.append(status)
+
+    return sorted(timeline, key=lambda status: status["id"])
@@ -0,0 +1,60 @@
+"""Measures how formatting posts for rendering scales with the number of worker processes.
+
+Run from the repository root:
+
+    python -m benchmarks.format_posts --posts 4000
+"""
+
+from benchmarks.fixtures import make_statuses, to_attrib_access_dict
+from content import parse_content
+from formatters import format_posts
+from models import ScoredPost
+import argparse
+import os
+import random
+import time
+
+
+def make_posts(post_count: int) -> list[ScoredPost]:
+    posts = []
+    for status in make_statuses(post_count):
+        status["emojis"] = to_attrib_access_dict(
+            [
+                {"shortcode": f"emoji{i}", "url": f"https://example.social/emoji/{i}.png"}
+                for i in range(10)
+            ]
+        )
+        status["content"] = status.content.replace("</p>", " :emoji3: :emoji7:</p>")
+        posts.append(ScoredPost(status, parse_content(status.content)))
+    return posts
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog="format_posts",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument("--posts", default=4000, type=int, help="Number of posts")
+    arg_parser.add_argument(
+        "--domains", default=30000, type=int, help="Number of known instance domains"
+    )
+    args = arg_parser.parse_args()
+
+    random.seed(42)
+    posts = make_posts(args.posts)
+    known_instance_domains = frozenset(
+        [f"instance{i}.example" for i in range(args.domains)] + ["example.social"]
+    )
+
+    worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    print(f"Formatting {len(posts)} posts on {os.cpu_count()} cores:")
+    baseline = None
+    for workers in worker_counts:
+        started_at = time.perf_counter()
+        formatted = format_posts(posts, "https://home.social", known_instance_domains, workers)
+        elapsed = time.perf_counter() - started_at
+        baseline = baseline or elapsed
+        print(
+            f"    workers = {workers}: {elapsed * 1000:.0f}ms, "
+            f"{baseline / elapsed:.2f}x, {len(formatted)} posts"
+        )
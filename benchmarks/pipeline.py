@@ -0,0 +1,230 @@
+"""Runs the digest pipeline against local fake Mastodon instances, without a live account.
+
+Generates a synthetic home timeline, serves it from a fake home instance and the posts
+from fake remote instances with injected latency, and reports the time, peak memory and
+requests of every stage. Run from the repository root:
+
+    python -m benchmarks.pipeline --posts 5000 --instances 20 --latency-ms 50
+
+The fetch stage stops at `timeline.posts_limit` posts like a real run does; the filter,
+threshold, format and render stages run over the whole timeline.
+"""
+
+from benchmarks.fake_mastodon import FakeMastodonInstance
+from benchmarks.fixtures import make_account, make_timeline, to_attrib_access_dict
+from collections import Counter
+from config import validate_config
+from contextlib import contextmanager
+from digested_posts import DigestedPostStore
+from domain_health import DomainHealth
+from formatters import format_posts
+from mastodon import Mastodon
+from metrics_cache import MetricsCache
+from models import ScoredPost
+from pathlib import Path
+from run import render_digest
+from scorers import ExtendedSimpleWeightedScorer
+from thresholds import Threshold
+import api
+import argparse
+import contextlib
+import io
+import random
+import resource
+import tempfile
+import time
+import tomllib
+import tracemalloc
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageReport:
+    def __init__(self, trace_memory: bool) -> None:
+        self._trace_memory = trace_memory
+        self.rows: list[tuple[str, float, float, float]] = []
+
+    @contextmanager
+    def stage(self, name: str, verbose: bool):
+        if self._trace_memory:
+            tracemalloc.reset_peak()
+        started_at = time.perf_counter()
+        # the stages print a lot of progress, which isn't what is measured here
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            yield
+        elapsed = time.perf_counter() - started_at
+        heap_peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024 if self._trace_memory else 0
+        self.rows.append((name, elapsed, peak_rss_mb(), heap_peak))
+
+    def print(self) -> None:
+        print("Stages:")
+        for name, elapsed, rss, heap_peak in self.rows:
+            heap = f", heap peak {heap_peak:.1f}MB" if self._trace_memory else ""
+            print(f"    {name:<10} {elapsed * 1000:>9.0f}ms, peak RSS {rss:.0f}MB{heap}")
+
+
+def make_config(work_dir: Path, post_count: int, hours: int):
+    with open("config.toml", "rb") as f:
+        config = tomllib.load(f)
+    config["timeline"] |= {
+        "posts_limit": min(max(post_count, 1000), 4000),
+        "hours_limit": hours,
+        "incremental": False,
+        "state_file": str(work_dir / "timeline_state.json.gz"),
+    }
+    config["post"] |= {"max_age_hours": hours + 1}
+    config["digest"] |= {"digested_posts_file": str(work_dir / "digested_posts.sqlite")}
+    config["enrichment"] = config.get("enrichment", {}) | {
+        "domain_health_file": str(work_dir / "domain_health.json")
+    }
+    config["cache"] = config.get("cache", {}) | {
+        "metrics_file": str(work_dir / "metrics_cache.sqlite"),
+        "known_instances_file": str(work_dir / "known_instances.json"),
+    }
+    return validate_config(config)
+
+
+def start_instances(args) -> tuple[FakeMastodonInstance, list[FakeMastodonInstance]]:
+    home = FakeMastodonInstance(args.home_latency_ms)
+    remotes = [FakeMastodonInstance(args.latency_ms) for _ in range(args.instances)]
+    timeline = make_timeline(
+        args.posts,
+        home.domain,
+        [remote.domain for remote in remotes],
+        hours=args.hours,
+        reply_depth=args.reply_depth,
+        boost_ratio=args.boost_ratio,
+        scheme="http",
+    )
+    home.set_home_timeline(timeline)
+    home.me = make_account(0, home.domain, "http")
+
+    remotes_by_domain = {remote.domain: remote for remote in remotes}
+    for status in timeline:
+        status = status["reblog"] or status
+        remotes_by_domain[status["account"]["acct"].split("@")[1]].statuses[status["id"]] = status
+
+    for instance in [home, *remotes]:
+        instance.start()
+    return home, remotes
+
+
+def run(args) -> None:
+    random.seed(args.seed)
+    if args.trace_memory:
+        tracemalloc.start()
+    report = StageReport(args.trace_memory)
+
+    with tempfile.TemporaryDirectory(prefix="mastodon_digest_benchmark") as work_dir:
+        work_dir = Path(work_dir)
+        (work_dir / "render").mkdir()
+        with report.stage("setup", args.verbose):
+            home, remotes = start_instances(args)
+            config = make_config(work_dir, args.posts, args.hours)
+            ScoredPost.configure_remote_session(config)
+            mastodon_client = Mastodon(access_token="benchmark", api_base_url=home.base_url)
+            known_instance_domains = frozenset(["127.0.0.1"])
+            timeline = [to_attrib_access_dict(status) for status in home.home_timeline]
+
+        try:
+            with report.stage("fetch", args.verbose):
+                digested_posts = DigestedPostStore(config)
+                domain_health = DomainHealth(config)
+                metrics_cache = MetricsCache(config)
+                fetched_posts, fetched_boosts = api.fetch_posts_and_boosts(
+                    digested_posts, mastodon_client, domain_health, metrics_cache, config
+                )
+                metrics_cache.close()
+                digested_posts.close()
+
+            with report.stage("filter", args.verbose):
+                digested_posts = DigestedPostStore(config)
+                filterator = api.PostFilterator(digested_posts, mastodon_client, config)
+                posts, boosts = [], []
+                for page_start in range(0, len(timeline), 40):
+                    page = timeline[page_start : page_start + 40]
+                    page_posts, boost_urls = filterator.filter_posts(page)
+                    for post in page_posts:
+                        (boosts if post.url in boost_urls else posts).append(post)
+                        filterator.add_seen_post_url(post.url)
+                digested_posts.close()
+
+            with report.stage("threshold", args.verbose):
+                threshold = Threshold(config.digest_threshold)
+                scorer = ExtendedSimpleWeightedScorer()
+                threshold_posts = threshold.posts_meeting_criteria(posts, set(), config, 0, scorer)
+                threshold_boosts = threshold.posts_meeting_criteria(
+                    boosts, set(), config, 0, scorer
+                )
+
+            with report.stage("format", args.verbose):
+                formatted_posts = format_posts(
+                    threshold_posts, home.base_url, known_instance_domains, args.format_workers
+                )
+                formatted_boosts = format_posts(
+                    threshold_boosts, home.base_url, known_instance_domains, args.format_workers
+                )
+
+            with report.stage("render", args.verbose):
+                render_digest(
+                    {
+                        "hours": args.hours,
+                        "posts": formatted_posts,
+                        "boosts": formatted_boosts,
+                        "rendered_at": "",
+                        "threshold": config.digest_threshold,
+                    },
+                    work_dir / "render",
+                    config.digest_posts_per_page,
+                )
+        finally:
+            for instance in [home, *remotes]:
+                instance.stop()
+
+    print(
+        f"Timeline of {args.posts} statuses, {args.instances} remote instances "
+        f"with {args.latency_ms}ms latency:"
+    )
+    print(f"    fetched {len(fetched_posts)} posts and {len(fetched_boosts)} boosts")
+    print(f"    filtered {len(posts)} posts and {len(boosts)} boosts")
+    print(f"    rendered {len(threshold_posts)} posts and {len(threshold_boosts)} boosts")
+    report.print()
+    print("Requests:")
+    print(f"    home: {dict(home.request_counts)}")
+    remote_counts = sum((remote.request_counts for remote in remotes), start=Counter())
+    print(f"    remote: {dict(remote_counts)}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog="pipeline",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument("--posts", default=5000, type=int, help="Statuses in the timeline")
+    arg_parser.add_argument("--instances", default=20, type=int, help="Remote instances")
+    arg_parser.add_argument(
+        "--latency-ms", default=50, type=int, help="Latency of every remote request"
+    )
+    arg_parser.add_argument(
+        "--home-latency-ms", default=0, type=int, help="Latency of every home instance request"
+    )
+    arg_parser.add_argument("--hours", default=24, type=int, help="Hours the timeline spans")
+    arg_parser.add_argument("--reply-depth", default=3, type=int, help="Max reply chain depth")
+    arg_parser.add_argument(
+        "--boost-ratio", default=0.2, type=float, help="Fraction of statuses that are boosts"
+    )
+    arg_parser.add_argument(
+        "--format-workers", default=1, type=int, help="Processes for formatting posts"
+    )
+    arg_parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Also report the peak Python heap of every stage, which slows the stages down",
+    )
+    arg_parser.add_argument("--verbose", action="store_true", help="Show the progress output")
+    arg_parser.add_argument("--seed", default=42, type=int, help="Random seed")
+    run(arg_parser.parse_args())
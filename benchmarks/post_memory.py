@@ -0,0 +1,57 @@
+"""Compares peak memory of keeping full API payloads of posts with keeping ScoredPosts.
+
+Each mode runs in its own process so that peak RSS of one doesn't hide the other.
+Run from the repository root:
+
+    python -m benchmarks.post_memory --posts 4000
+"""
+
+from benchmarks.fixtures import make_statuses
+from models import ScoredPost
+import argparse
+import gc
+import random
+import resource
+import subprocess
+import sys
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(mode: str, post_count: int) -> None:
+    random.seed(42)
+    baseline = peak_rss_mb()
+    posts = []
+    # build the payloads in pages like the timeline does, so that compact posts can
+    # release their page before the next one is fetched
+    for _ in range(post_count // 40):
+        page = make_statuses(40)
+        if mode == "full":
+            posts.extend(page)
+        else:
+            posts.extend(ScoredPost(status) for status in page)
+        del page
+        gc.collect()
+    peak_rss = peak_rss_mb() - baseline
+    print(f"    {mode}: {len(posts)} posts, peak RSS {peak_rss:.1f}MB over baseline")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog="post_memory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument("--posts", default=4000, type=int, help="Number of posts")
+    arg_parser.add_argument("--mode", choices=["full", "compact"], help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.mode is not None:
+        run_mode(args.mode, args.posts)
+    else:
+        print(f"Peak memory for {args.posts} posts:")
+        for mode in ["full", "compact"]:
+            command = [sys.executable, "-m", "benchmarks.post_memory", "--posts", str(args.posts)]
+            subprocess.run(command + ["--mode", mode], check=True)
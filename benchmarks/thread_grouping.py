@@ -0,0 +1,97 @@
+"""Compares thread grouping with union-find to the fixpoint iteration it replaced.
+
+Run from the repository root:
+
+    python -m benchmarks.thread_grouping --posts 10000 --chain-length 200
+"""
+
+from thresholds import ThreadIndex
+from types import SimpleNamespace
+import argparse
+import random
+import time
+
+
+def make_timeline(post_count: int, chain_length: int, reply_frac: float) -> list:
+    posts = []
+    next_id = 1
+    while len(posts) < post_count:
+        if random.random() < reply_frac:
+            # a reply chain, with the root sometimes missing from the timeline
+            root_id = next_id
+            next_id += 1
+            if random.random() < 0.5:
+                posts.append(SimpleNamespace(id=root_id, in_reply_to_id=None))
+            parent_id = root_id
+            for _ in range(random.randint(1, chain_length)):
+                posts.append(SimpleNamespace(id=next_id, in_reply_to_id=parent_id))
+                parent_id = next_id
+                next_id += 1
+        else:
+            posts.append(SimpleNamespace(id=next_id, in_reply_to_id=None))
+            next_id += 1
+    random.shuffle(posts)
+    return posts[:post_count]
+
+
+def group_by_fixpoint(posts: list) -> list[set[int]]:
+    post_reply_to_id_map: dict[int, set[int]] = {}
+
+    for post in posts:
+        if post.in_reply_to_id is not None:
+            post_reply_to_id_map[post.id] = {post.in_reply_to_id}
+
+    while True:
+        changed = False
+        for id, reply_to_ids in post_reply_to_id_map.items():
+            for reply_to_id in reply_to_ids:
+                if reply_to_id in post_reply_to_id_map:
+                    parents = post_reply_to_id_map[reply_to_id]
+                    for parent in parents:
+                        if not (parent in reply_to_ids):
+                            post_reply_to_id_map[id] = set(reply_to_ids)
+                            post_reply_to_id_map[id].add(parent)
+                            changed = True
+        if not changed:
+            break
+
+    for id in list(post_reply_to_id_map.keys()):
+        if id in post_reply_to_id_map:
+            for reply_to_id in post_reply_to_id_map[id]:
+                if reply_to_id in post_reply_to_id_map:
+                    del post_reply_to_id_map[reply_to_id]
+
+    for id in post_reply_to_id_map:
+        post_reply_to_id_map[id].add(id)
+
+    return list(post_reply_to_id_map.values())
+
+
+def group_by_union_find(posts: list) -> list[set[int]]:
+    return ThreadIndex(posts).threads()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog="thread_grouping",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument("--posts", default=10000, type=int, help="Number of posts")
+    arg_parser.add_argument(
+        "--chain-length", default=200, type=int, help="Maximum length of reply chains"
+    )
+    arg_parser.add_argument(
+        "--reply-frac", default=0.2, type=float, help="Fraction of posts that start a chain"
+    )
+    arg_parser.add_argument("--seed", default=42, type=int, help="Random seed")
+    args = arg_parser.parse_args()
+
+    random.seed(args.seed)
+    posts = make_timeline(args.posts, args.chain_length, args.reply_frac)
+    print(f"Timeline of {len(posts)} posts, reply chains up to {args.chain_length} long")
+
+    for name, group in [("fixpoint", group_by_fixpoint), ("union-find", group_by_union_find)]:
+        started_at = time.perf_counter()
+        threads = group(posts)
+        elapsed = time.perf_counter() - started_at
+        print(f"    {name}: {len(threads)} threads in {elapsed * 1000:.1f}ms")
@@ -1,5 +1,7 @@
 from collections import defaultdict
 from dataclasses import dataclass, field
+from functools import cached_property
+from tag_rules import TagRules
 from typing import Any, Type
 import math
 import tomllib
@@ -45,6 +47,22 @@ class SetDescriptor(TypedDescriptor):
             setattr(obj, self._name, value)
 
 
+class DictDescriptor(TypedDescriptor):
+    def __init__(self, *, key_type: Type, value_type: Type) -> None:
+        super().__init__(default=dict, type_=dict)
+        self.key_type = key_type
+        self.value_type = value_type
+
+    def __set__(self, obj: Any, value: Any) -> None:
+        if self._check_type(value):
+            for k, v in value.items():
+                if type(k) != self.key_type:
+                    raise AttributeError(f"{k} is not of type: {self.key_type}")
+                if type(v) != self.value_type:
+                    raise AttributeError(f"{v} is not of type: {self.value_type}")
+            setattr(obj, self._name, value)
+
+
 class RangedTypedDescriptor(TypedDescriptor):
     def __init__(self, *, default: Any, type_: Type, min_value: Any, max_value: Any) -> None:
         super().__init__(default=default, type_=type_)
@@ -84,6 +102,10 @@ class Config:
     timeline_max_user_post_count: IntDescriptor = IntDescriptor(
         default=3, min_value=1, max_value=math.inf
     )
+    timeline_incremental: TypedDescriptor = TypedDescriptor(default=False, type_=bool)
+    timeline_state_file: TypedDescriptor = TypedDescriptor(
+        default="timeline_state.json.gz", type_=str
+    )
     post_min_word_count: IntDescriptor = IntDescriptor(default=10, min_value=3, max_value=1000)
     post_max_age_hours: IntDescriptor = IntDescriptor(default=36, min_value=1, max_value=240)
     post_languages: SetDescriptor = SetDescriptor(subtype=str)
@@ -93,6 +115,7 @@ class Config:
     scoring_bot_unboost: FloatDescriptor = FloatDescriptor(default=1.2, min_value=1, max_value=2)
     scoring_halflife_hours: IntDescriptor = IntDescriptor(default=0, min_value=1, max_value=24)
     scoring_tag_count_threshold: IntDescriptor = IntDescriptor(default=3, min_value=1, max_value=10)
+    scoring_tag_weights: DictDescriptor = DictDescriptor(key_type=str, value_type=float)
     digest_explore_frac: FloatDescriptor = FloatDescriptor(
         default=0.0, min_value=0.0, max_value=0.5
     )
@@ -100,9 +123,85 @@ class Config:
     digest_boosted_tags: SetDescriptor = SetDescriptor(subtype=str)
     digest_unboosted_tags: SetDescriptor = SetDescriptor(subtype=str)
     digest_boosted_list_ids: SetDescriptor = SetDescriptor(subtype=int)
+    digest_format_workers: IntDescriptor = IntDescriptor(default=1, min_value=0, max_value=64)
+    digest_posts_per_page: IntDescriptor = IntDescriptor(default=0, min_value=0, max_value=1000)
     digest_digested_posts_file: TypedDescriptor = TypedDescriptor(
-        default="digested_posts.json", type_=str
+        default="digested_posts.sqlite", type_=str
+    )
+    dedupe_bloom_filter: TypedDescriptor = TypedDescriptor(default=False, type_=bool)
+    dedupe_false_positive_rate: FloatDescriptor = FloatDescriptor(
+        default=0.01, min_value=0.0001, max_value=0.1
+    )
+    dedupe_near_duplicates: TypedDescriptor = TypedDescriptor(default=True, type_=bool)
+    dedupe_near_duplicate_similarity: FloatDescriptor = FloatDescriptor(
+        default=0.7, min_value=0.5, max_value=1.0
+    )
+    enrichment_workers: IntDescriptor = IntDescriptor(default=16, min_value=1, max_value=128)
+    enrichment_instance_workers: IntDescriptor = IntDescriptor(
+        default=4, min_value=1, max_value=32
+    )
+    enrichment_deadline_minutes: IntDescriptor = IntDescriptor(
+        default=15, min_value=1, max_value=180
+    )
+    enrichment_circuit_failure_threshold: IntDescriptor = IntDescriptor(
+        default=3, min_value=1, max_value=100
+    )
+    enrichment_circuit_cooldown_minutes: IntDescriptor = IntDescriptor(
+        default=60, min_value=1, max_value=1440
+    )
+    enrichment_bad_domain_ttl_hours: IntDescriptor = IntDescriptor(
+        default=168, min_value=1, max_value=720
     )
+    enrichment_domain_health_file: TypedDescriptor = TypedDescriptor(
+        default="domain_health.json", type_=str
+    )
+    http_max_hosts: IntDescriptor = IntDescriptor(default=200, min_value=1, max_value=10000)
+    http_max_connections_per_host: IntDescriptor = IntDescriptor(
+        default=4, min_value=1, max_value=32
+    )
+    cache_metrics_file: TypedDescriptor = TypedDescriptor(
+        default="metrics_cache.sqlite", type_=str
+    )
+    cache_metrics_max_entries: IntDescriptor = IntDescriptor(
+        default=50000, min_value=1000, max_value=1000000
+    )
+    cache_metrics_min_ttl_minutes: IntDescriptor = IntDescriptor(
+        default=30, min_value=1, max_value=1440
+    )
+    cache_metrics_max_ttl_hours: IntDescriptor = IntDescriptor(
+        default=36, min_value=1, max_value=240
+    )
+    cache_metrics_ttl_age_frac: FloatDescriptor = FloatDescriptor(
+        default=0.25, min_value=0.0, max_value=1.0
+    )
+    instrumentation_report_file: TypedDescriptor = TypedDescriptor(
+        default="run_report.json", type_=str
+    )
+    instrumentation_prometheus_file: TypedDescriptor = TypedDescriptor(default="", type_=str)
+    cache_known_instances_file: TypedDescriptor = TypedDescriptor(
+        default="known_instances.json", type_=str
+    )
+    cache_known_instances_max_age_hours: IntDescriptor = IntDescriptor(
+        default=24, min_value=1, max_value=720
+    )
+
+    @cached_property
+    def tag_rules(self) -> TagRules:
+        return TagRules(
+            self.digest_boosted_tags,
+            self.digest_unboosted_tags,
+            self.scoring_tag_boost,
+            self.scoring_tag_weights,
+        )
+
+
+def validate_tag_weights(tag_weights: dict) -> dict[str, float]:
+    validated = {}
+    for tag, weight in tag_weights.items():
+        if type(weight) not in (int, float) or weight <= 0:
+            raise AttributeError(f"{weight} is not a positive weight for tag: {tag}")
+        validated[tag.lower()] = float(weight)
+    return validated
 
 
 def validate_config(config: dict) -> Config:
@@ -110,6 +209,11 @@ def validate_config(config: dict) -> Config:
     post = defaultdict(lambda: None) | config["post"]
     scoring = defaultdict(lambda: None) | config["scoring"]
     digest = defaultdict(lambda: None) | config["digest"]
+    dedupe = defaultdict(lambda: None) | config.get("dedupe", {})
+    enrichment = defaultdict(lambda: None) | config.get("enrichment", {})
+    http = defaultdict(lambda: None) | config.get("http", {})
+    cache = defaultdict(lambda: None) | config.get("cache", {})
+    instrumentation = defaultdict(lambda: None) | config.get("instrumentation", {})
 
     return Config(
         timeline_posts_limit=timeline["posts_limit"],
@@ -117,6 +221,8 @@ def validate_config(config: dict) -> Config:
         timeline_exclude_trending=timeline["exclude_trending"],
         timeline_exclude_previously_digested_posts=timeline["exclude_previously_digested_posts"],
         timeline_max_user_post_count=timeline["max_user_post_count"],
+        timeline_incremental=timeline["incremental"],
+        timeline_state_file=timeline["state_file"],
         post_min_word_count=post["min_word_count"],
         post_max_age_hours=post["max_age_hours"],
         post_languages=frozenset(l.lower() for l in post.get("languages", [])),
@@ -126,12 +232,37 @@ def validate_config(config: dict) -> Config:
         scoring_bot_unboost=scoring["bot_unboost"],
         scoring_halflife_hours=scoring["halflife_hours"],
         scoring_tag_count_threshold=scoring["tag_count_threshold"],
+        scoring_tag_weights=validate_tag_weights(scoring.get("tag_weights", {})),
         digest_explore_frac=digest["explore_frac"],
         digest_threshold=digest["threshold"],
         digest_boosted_tags=frozenset(t.lower() for t in digest.get("boosted_tags", [])),
         digest_unboosted_tags=frozenset(t.lower() for t in digest.get("unboosted_tags", [])),
         digest_boosted_list_ids=frozenset(digest.get("boosted_list_ids", [])),
+        digest_format_workers=digest["format_workers"],
+        digest_posts_per_page=digest["posts_per_page"],
         digest_digested_posts_file=digest["digested_posts_file"],
+        dedupe_bloom_filter=dedupe["bloom_filter"],
+        dedupe_false_positive_rate=dedupe["false_positive_rate"],
+        dedupe_near_duplicates=dedupe["near_duplicates"],
+        dedupe_near_duplicate_similarity=dedupe["near_duplicate_similarity"],
+        enrichment_workers=enrichment["workers"],
+        enrichment_instance_workers=enrichment["instance_workers"],
+        enrichment_deadline_minutes=enrichment["deadline_minutes"],
+        enrichment_circuit_failure_threshold=enrichment["circuit_failure_threshold"],
+        enrichment_circuit_cooldown_minutes=enrichment["circuit_cooldown_minutes"],
+        enrichment_bad_domain_ttl_hours=enrichment["bad_domain_ttl_hours"],
+        enrichment_domain_health_file=enrichment["domain_health_file"],
+        http_max_hosts=http["max_hosts"],
+        http_max_connections_per_host=http["max_connections_per_host"],
+        cache_metrics_file=cache["metrics_file"],
+        cache_metrics_max_entries=cache["metrics_max_entries"],
+        cache_metrics_min_ttl_minutes=cache["metrics_min_ttl_minutes"],
+        cache_metrics_max_ttl_hours=cache["metrics_max_ttl_hours"],
+        cache_metrics_ttl_age_frac=cache["metrics_ttl_age_frac"],
+        instrumentation_report_file=instrumentation["report_file"],
+        instrumentation_prometheus_file=instrumentation["prometheus_file"],
+        cache_known_instances_file=cache["known_instances_file"],
+        cache_known_instances_max_age_hours=cache["known_instances_max_age_hours"],
     )
 
 
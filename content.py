@@ -0,0 +1,79 @@
+from bs4 import BeautifulSoup
+from dataclasses import dataclass
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+try:
+    import lxml
+
+    BS4_PARSER = "lxml"
+except ImportError:
+    BS4_PARSER = "html.parser"
+
+
+@dataclass(frozen=True)
+class Link:
+    href: str
+    is_mention: bool
+
+
+@dataclass(frozen=True)
+class ParsedContent:
+    """What the filters and formatters need to know about the HTML content of a post.
+
+    Produced once per post so that the content is parsed only once per run.
+    """
+
+    text: str
+    words: tuple[str, ...]
+    links: tuple[Link, ...]
+
+    @property
+    def non_mention_links(self) -> list[Link]:
+        return [link for link in self.links if not link.is_mention]
+
+    @property
+    def mentions(self) -> list[Link]:
+        return [link for link in self.links if link.is_mention]
+
+
+def parse_content(content: str) -> ParsedContent:
+    """Parses post HTML with selectolax if it is installed, else with BeautifulSoup"""
+    if HTMLParser is not None:
+        text, links = _parse_with_selectolax(content)
+    else:
+        text, links = _parse_with_bs4(content)
+
+    words = tuple(
+        word
+        for word in text.split()
+        if not (word.startswith("#") or word.startswith("@") or word.startswith("http"))
+    )
+    return ParsedContent(text=text, words=words, links=links)
+
+
+def _parse_with_selectolax(content: str) -> tuple[str, tuple[Link, ...]]:
+    tree = HTMLParser(content)
+    if tree.body is None:
+        return "", ()
+
+    links = tuple(
+        Link(
+            href=node.attributes.get("href") or "",
+            is_mention="mention" in (node.attributes.get("class") or "").split(),
+        )
+        for node in tree.css("a")
+    )
+    return tree.body.text(separator=" ", strip=True), links
+
+
+def _parse_with_bs4(content: str) -> tuple[str, tuple[Link, ...]]:
+    soup = BeautifulSoup(content, BS4_PARSER)
+    links = tuple(
+        Link(href=tag.attrs.get("href", ""), is_mention="mention" in tag.attrs.get("class", []))
+        for tag in soup.find_all("a")
+    )
+    return soup.get_text(" ", strip=True), links
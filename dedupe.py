@@ -0,0 +1,90 @@
+from hashlib import blake2b
+import math
+import sys
+
+
+def fingerprint(value: str) -> int:
+    """A 64-bit hash of the value, to keep in sets instead of the value itself"""
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), "little")
+
+
+def normalize_text(words: tuple[str, ...]) -> str:
+    # case and spacing differences don't make a post a different post
+    return " ".join(word.lower() for word in words)
+
+
+def content_key(
+    words: tuple[str, ...],
+    media_urls: list[str],
+    poll_options: list[str],
+    link_hrefs: list[str],
+) -> str:
+    # posts with the same short caption on different media, polls or links are different
+    # posts, so the key covers all of them
+    return "\x1e".join(
+        [
+            normalize_text(words),
+            "\x1f".join(media_urls),
+            "\x1f".join(poll_options),
+            "\x1f".join(link_hrefs),
+        ]
+    )
+
+
+class FingerprintSet:
+    """A set of strings that keeps only their fingerprints"""
+
+    def __init__(self) -> None:
+        self._fingerprints: set[int] = set()
+
+    def add(self, value: str) -> int:
+        value_fingerprint = fingerprint(value)
+        self._fingerprints.add(value_fingerprint)
+        return value_fingerprint
+
+    def add_fingerprint(self, value_fingerprint: int) -> None:
+        self._fingerprints.add(value_fingerprint)
+
+    def __contains__(self, value: str) -> bool:
+        return fingerprint(value) in self._fingerprints
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def memory_bytes(self) -> int:
+        return sys.getsizeof(self._fingerprints) + sum(
+            sys.getsizeof(f) for f in self._fingerprints
+        )
+
+
+class BloomFilter:
+    """A set of strings in a fixed amount of memory, sized for the expected number of items
+    and the acceptable rate of false positives. Never has false negatives."""
+
+    def __init__(self, expected_items: int, false_positive_rate: float) -> None:
+        expected_items = max(expected_items, 1)
+        self._bit_count = max(
+            8,
+            math.ceil(-expected_items * math.log(false_positive_rate) / (math.log(2) ** 2)),
+        )
+        self._hash_count = max(1, round(self._bit_count / expected_items * math.log(2)))
+        self._bits = bytearray(math.ceil(self._bit_count / 8))
+
+    def _bit_indexes(self, value: str) -> list[int]:
+        # double hashing: the k hashes are combinations of the two halves of one digest
+        digest = blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self._bit_count for i in range(self._hash_count)]
+
+    def add(self, value: str) -> None:
+        for index in self._bit_indexes(value):
+            self._bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(
+            self._bits[index >> 3] & (1 << (index & 7)) for index in self._bit_indexes(value)
+        )
+
+    def memory_bytes(self) -> int:
+        return len(self._bits)
@@ -0,0 +1,122 @@
+from collections import defaultdict
+from config import Config
+from datetime import datetime, timedelta, timezone
+from dedupe import BloomFilter
+from pathlib import Path
+from typing import Iterable, Optional
+import json
+import sqlite3
+
+
+class DigestedPostStore:
+    """The URLs of posts that were in earlier digests, with when they were digested.
+
+    Membership checks are index lookups, so the history doesn't have to be loaded at
+    startup. URLs are forgotten once their posts are too old to be in a digest again.
+
+    With `dedupe_bloom_filter` enabled, the URLs are also kept in a Bloom filter so that
+    most checks for URLs that were never digested don't touch the database at all.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self._config = config
+        self._bloom_filter: Optional[BloomFilter] = None
+        self._stats = defaultdict(int)
+        self._connection = sqlite3.connect(config.digest_digested_posts_file)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS digested_posts (
+                    url TEXT PRIMARY KEY,
+                    digested_at REAL NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                """
+                CREATE INDEX IF NOT EXISTS digested_posts_digested_at
+                ON digested_posts (digested_at)
+                """
+            )
+        self._import_legacy_file()
+        if config.dedupe_bloom_filter:
+            self._load_bloom_filter()
+
+    def _load_bloom_filter(self) -> None:
+        # leave room for the URLs added in the coming runs
+        self._bloom_filter = BloomFilter(
+            max(2 * len(self), 10000), self._config.dedupe_false_positive_rate
+        )
+        for (url,) in self._connection.execute("SELECT url FROM digested_posts"):
+            self._bloom_filter.add(url)
+
+    def _import_legacy_file(self) -> None:
+        # earlier versions kept the URLs in a JSON list next to the database
+        legacy_file = Path(self._config.digest_digested_posts_file).with_suffix(".json")
+        if not legacy_file.is_file() or len(self) > 0:
+            return
+
+        with open(legacy_file, "r") as f:
+            try:
+                post_urls = json.load(f)
+                assert type(post_urls) == list
+            except json.JSONDecodeError:
+                return
+
+        self.add(post_urls)
+        print(f"Imported {len(post_urls)} digested post URLs from {legacy_file}")
+
+    def __contains__(self, url: str) -> bool:
+        if self._bloom_filter is not None and url not in self._bloom_filter:
+            self._stats["bloom_filter_negative_count"] += 1
+            return False
+
+        found = (
+            self._connection.execute(
+                "SELECT 1 FROM digested_posts WHERE url = ?", (url,)
+            ).fetchone()
+            is not None
+        )
+        if self._bloom_filter is not None and not found:
+            self._stats["bloom_filter_false_positive_count"] += 1
+        return found
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM digested_posts").fetchone()[0]
+
+    def add(self, urls: Iterable[str]) -> None:
+        urls = list(urls)
+        if self._bloom_filter is not None:
+            for url in urls:
+                self._bloom_filter.add(url)
+
+        digested_at = datetime.now(timezone.utc).timestamp()
+        # a single transaction, so either all or none of the URLs are saved
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO digested_posts VALUES (?, ?)",
+                ((url, digested_at) for url in urls),
+            )
+
+    def expire(self) -> int:
+        """Forgets the posts digested before the max post age, which can't be digested again"""
+        min_digested_at = datetime.now(timezone.utc) - timedelta(
+            hours=self._config.post_max_age_hours
+        )
+        with self._connection:
+            cursor = self._connection.execute(
+                "DELETE FROM digested_posts WHERE digested_at < ?",
+                (min_digested_at.timestamp(),),
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def print_stats(self) -> None:
+        if self._bloom_filter is None:
+            return
+
+        print(f"Digested posts Bloom filter of {self._bloom_filter.memory_bytes() / 1024:.0f}KB:")
+        for key, val in self._stats.items():
+            print(f"    {key} = {val}")
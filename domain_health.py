@@ -0,0 +1,126 @@
+from collections import defaultdict
+from config import Config
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+class DomainHealth:
+    """Tracks which remote instances can be asked for post metrics.
+
+    A domain is blocked until a point in time when it is rate limited, when its circuit
+    opens after too many consecutive failures, or when it turns out not to serve the
+    Mastodon API. Blocks are saved to a file so that later runs skip known bad domains.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self._config = config
+        self._lock = threading.Lock()
+        self._blocked_until: dict[str, float] = {}
+        self._consecutive_failures: defaultdict[str, int] = defaultdict(int)
+        self._stats = defaultdict(int)
+
+    def load(self) -> None:
+        path = self._config.enrichment_domain_health_file
+        if not os.path.isfile(path):
+            return
+
+        with open(path, "r") as f:
+            try:
+                blocked_until = json.load(f)
+                assert type(blocked_until) == dict
+            except json.JSONDecodeError:
+                return
+
+        now = time.time()
+        with self._lock:
+            self._blocked_until = {
+                domain: until for domain, until in blocked_until.items() if until > now
+            }
+        print(f"Read {len(self._blocked_until)} blocked domains")
+
+    def save(self) -> None:
+        now = time.time()
+        with self._lock:
+            blocked_until = {
+                domain: until for domain, until in self._blocked_until.items() if until > now
+            }
+
+        with tempfile.NamedTemporaryFile(
+            "w", prefix="mastodon_digest_domain_health", suffix=".json", delete=False
+        ) as f:
+            json.dump(blocked_until, f)
+            tempPath = f.name
+
+        shutil.move(tempPath, self._config.enrichment_domain_health_file)
+        print(f"Saved {len(blocked_until)} blocked domains")
+
+    def is_available(self, domain: str) -> bool:
+        with self._lock:
+            blocked_until = self._blocked_until.get(domain)
+            if blocked_until is None:
+                return True
+            if blocked_until <= time.time():
+                del self._blocked_until[domain]
+                return True
+            self._stats["blocked_request_count"] += 1
+            return False
+
+    def record_success(self, domain: str) -> None:
+        with self._lock:
+            self._consecutive_failures[domain] = 0
+
+    def record_failure(self, domain: str) -> None:
+        with self._lock:
+            self._stats["failure_count"] += 1
+            self._consecutive_failures[domain] += 1
+            if (
+                self._consecutive_failures[domain]
+                >= self._config.enrichment_circuit_failure_threshold
+            ):
+                print(f"Too many failures, skipping {domain} for a while")
+                self._stats["opened_circuit_count"] += 1
+                # count again from zero after the cooldown, so that failures reopen the circuit
+                self._consecutive_failures[domain] = 0
+                self._block(domain, self._config.enrichment_circuit_cooldown_minutes * 60)
+
+    def record_rate_limited(self, domain: str, until: Optional[float]) -> None:
+        with self._lock:
+            self._stats["rate_limited_count"] += 1
+            # fall back to waiting a minute if the server didn't say for how long
+            self._block(domain, until - time.time() if until is not None else 60)
+
+    def mark_bad(self, domain: str) -> None:
+        with self._lock:
+            print(f"Marking {domain} as a bad domain")
+            self._stats["bad_domain_count"] += 1
+            self._block(domain, self._config.enrichment_bad_domain_ttl_hours * 60 * 60)
+
+    def _block(self, domain: str, duration: float) -> None:
+        # must be called with the lock held
+        until = time.time() + max(duration, 0)
+        self._blocked_until[domain] = max(self._blocked_until.get(domain, 0), until)
+
+    def print_stats(self) -> None:
+        print(f"Domain health:")
+        for key, val in self._stats.items():
+            print(f"    {key} = {val}")
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header value into a unix timestamp"""
+    if value is None:
+        return None
+
+    if value.isdigit():
+        return time.time() + int(value)
+
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,219 @@
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from domain_health import DomainHealth
+from instrumentation import run_metrics
+from metrics_cache import MetricsCache
+from models import PostMetrics, ScoredPost
+from typing import Optional
+import threading
+import time
+
+
+class MetricsEnricher:
+    """Fetches the metrics of posts from their origin instances concurrently.
+
+    Posts are grouped by their origin instance, and every instance is probed once before
+    any of its posts are fetched; the posts of instances that can't be used are dropped
+    without further requests. At most `enrichment_workers` requests run at once, and at
+    most `enrichment_instance_workers` of them against the same instance. Posts that are
+    not enriched before the deadline, counted from the creation of the enricher, keep the
+    metrics seen by the home instance. Metrics and resolved status ids found in the cache
+    are used without fetching.
+
+    Posts can be submitted in batches while earlier batches are still being enriched;
+    `finish` waits for all of them.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        domain_health: DomainHealth,
+        metrics_cache: Optional[MetricsCache] = None,
+    ) -> None:
+        self._domain_health = domain_health
+        self._metrics_cache = metrics_cache
+        self._instance_workers = config.enrichment_instance_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.enrichment_workers, thread_name_prefix="enricher"
+        )
+        self._deadline = time.monotonic() + config.enrichment_deadline_minutes * 60
+        self._lock = threading.Lock()
+        self._all_done = threading.Condition(self._lock)
+        # instance API base URL -> None while probing, then whether it can be used
+        self._instances: dict[str, Optional[bool]] = {}
+        self._queued: defaultdict[str, deque[ScoredPost]] = defaultdict(deque)
+        self._in_flight: defaultdict[str, int] = defaultdict(int)
+        self._pending_count = 0
+        self._submitted_count = 0
+        self._finished_count = 0
+        self._expired = False
+        self._started_at = time.monotonic()
+        self._stats = defaultdict(int)
+
+    def submit(self, posts: list[ScoredPost]) -> None:
+        with self._lock:
+            if self._expired:
+                self._stats["deadline_skipped_post_count"] += len(posts)
+                return
+
+            for post in posts:
+                if post.visibility == "private":
+                    self._stats["private_post_count"] += 1
+                    continue
+
+                if self._metrics_cache is not None:
+                    metrics = self._metrics_cache.get(post.url)
+                    if metrics is not None:
+                        post.set_metrics(metrics)
+                        self._stats["cached_post_count"] += 1
+                        continue
+
+                instance = post.origin_api_base_url
+                if self._instances.get(instance) is False:
+                    self._stats["unavailable_instance_post_count"] += 1
+                    continue
+
+                self._queued[instance].append(post)
+                self._pending_count += 1
+                self._submitted_count += 1
+                if instance not in self._instances:
+                    self._instances[instance] = None
+                    self._executor.submit(self._probe, instance)
+
+            self._dispatch()
+
+    def enrich(self, posts: list[ScoredPost]) -> None:
+        self.submit(posts)
+        self.finish()
+
+    def finish(self) -> None:
+        """Waits for all submitted posts to be enriched, or for the deadline to pass"""
+        with self._lock:
+            while self._pending_count > 0:
+                remaining = self._deadline - time.monotonic()
+                if remaining <= 0 or not self._all_done.wait(timeout=remaining):
+                    if self._pending_count > 0:
+                        self._expire()
+                    break
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            for key, val in self._stats.items():
+                run_metrics.add_count(f"enrichment_{key}", val)
+
+    def _dispatch(self) -> None:
+        # must be called with the lock held
+        for instance in self._queued:
+            self._dispatch_instance(instance)
+
+    def _dispatch_instance(self, instance: str) -> None:
+        # must be called with the lock held
+        if not self._instances.get(instance):
+            return
+
+        queue = self._queued[instance]
+        while queue and self._in_flight[instance] < self._instance_workers:
+            post = queue.popleft()
+            self._in_flight[instance] += 1
+            self._executor.submit(self._fetch, post, instance)
+
+    def _probe(self, instance: str) -> None:
+        # runs on a worker thread
+        mastodon_client = None
+        try:
+            mastodon_client = ScoredPost.get_mastodon_client(instance, self._domain_health)
+        finally:
+            self._on_probed(instance, mastodon_client is not None)
+
+    def _on_probed(self, instance: str, available: bool) -> None:
+        with self._lock:
+            if self._expired:
+                return
+
+            self._instances[instance] = available
+            if available:
+                self._dispatch_instance(instance)
+                return
+
+            dropped_count = len(self._queued[instance])
+            self._queued[instance].clear()
+            self._stats["unavailable_instance_count"] += 1
+            self._stats["unavailable_instance_post_count"] += dropped_count
+            self._pending_count -= dropped_count
+            self._finished_count += dropped_count
+            if self._pending_count == 0:
+                self._all_done.notify_all()
+
+    def _fetch(self, post: ScoredPost, instance: str) -> None:
+        # runs on a worker thread
+        metrics: Optional[PostMetrics] = None
+        cached = False
+        try:
+            if self._metrics_cache is not None:
+                # another enricher sharing the cache may have fetched the post since
+                metrics = self._metrics_cache.get(post.url, record=False)
+                cached = metrics is not None
+            if not cached:
+                status_id = self._resolve_status_id(post)
+                if status_id is not None:
+                    metrics = post.fetch_metrics(self._domain_health, status_id)
+        finally:
+            self._on_fetched(post, instance, metrics, cached)
+
+    def _resolve_status_id(self, post: ScoredPost) -> Optional[str]:
+        # runs on a worker thread
+        if not post.needs_status_id_resolution() or self._metrics_cache is None:
+            return post.resolve_status_id(self._domain_health)
+
+        status_id = self._metrics_cache.get_status_id(post.url)
+        if status_id is None:
+            status_id = post.resolve_status_id(self._domain_health)
+            if status_id is not None:
+                self._metrics_cache.put_status_id(post.url, post.created_at, status_id)
+        return status_id
+
+    def _on_fetched(
+        self, post: ScoredPost, instance: str, metrics: Optional[PostMetrics], cached: bool
+    ) -> None:
+        with self._lock:
+            if self._expired:
+                return
+
+            self._in_flight[instance] -= 1
+            self._pending_count -= 1
+            self._finished_count += 1
+            if cached:
+                post.set_metrics(metrics)
+                self._stats["cached_post_count"] += 1
+            elif metrics is not None:
+                post.set_metrics(metrics)
+                if self._metrics_cache is not None:
+                    self._metrics_cache.put(post.url, post.created_at, metrics)
+                self._stats["enriched_post_count"] += 1
+                print(
+                    f"[{self._finished_count}/{self._submitted_count}] "
+                    f"Fetched metrics for {post.url}"
+                )
+            else:
+                self._stats["failed_post_count"] += 1
+
+            if self._pending_count == 0:
+                self._all_done.notify_all()
+            else:
+                self._dispatch_instance(instance)
+
+    def _expire(self) -> None:
+        # must be called with the lock held
+        self._expired = True
+        self._stats["deadline_skipped_post_count"] += self._pending_count
+        self._pending_count = 0
+        self._queued.clear()
+        print("Enrichment deadline reached, skipping remaining posts")
+
+    def print_stats(self) -> None:
+        elapsed = time.monotonic() - self._started_at
+        print(f"Enriched {self._stats['enriched_post_count']} posts in {elapsed:.1f}s:")
+        print(f"    instance_count = {len(self._instances)}")
+        for key, val in self._stats.items():
+            print(f"    {key} = {val}")
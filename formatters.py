@@ -1,34 +1,51 @@
-from bs4 import BeautifulSoup
-from models import ScoredPost
+from known_instances import is_known_instance_url
+from concurrent.futures import ProcessPoolExecutor
+from models import PostEmoji, ScoredPost
 import html
+import math
+import multiprocessing
+import os
+import re
 
+ANCHOR_HREF_RE = re.compile(r"""(<a\s[^>]*?\bhref=)(["'])(.*?)\2""", flags=re.IGNORECASE)
 
-def fix_post_links(post: ScoredPost, known_instance_domains: set[str]) -> str:
-    soup = BeautifulSoup(post.content, "html.parser")
 
-    for mention in soup.find_all("a", class_="mention"):
-        mention.attrs["href"] = "https://main.elk.zone/" + mention.attrs["href"]
-
-    non_mention_links = soup.find_all(
-        lambda tag: tag.name == "a" and "mention" not in tag.attrs.get("class", [])
+def fix_post_links(post: ScoredPost, known_instance_domains: frozenset[str]) -> str:
+    # use the links found when the post was filtered instead of parsing the content again
+    links = post.links
+    hrefs_to_fix = set(link.href for link in links if link.is_mention) | set(
+        link.href
+        for link in links
+        if not link.is_mention
+        and is_known_instance_url(link.href, known_instance_domains)
     )
-    for link in non_mention_links:
-        if "href" in link.attrs and any(
-            link.attrs["href"].find(domain) != -1 for domain in known_instance_domains
-        ):
-            link.attrs["href"] = "https://main.elk.zone/" + link.attrs["href"]
+    if not hrefs_to_fix:
+        return post.content
+
+    def fix_link(match: re.Match) -> str:
+        prefix, quote, href = match.groups()
+        if html.unescape(href) in hrefs_to_fix:
+            href = "https://main.elk.zone/" + href
+        return f"{prefix}{quote}{href}{quote}"
+
+    return ANCHOR_HREF_RE.sub(fix_link, post.content)
 
-    return str(soup)
 
+def replace_emojis(content: str, emojis: tuple[PostEmoji, ...]) -> str:
+    if not emojis:
+        return content
 
-def replace_emojis(content: str, emojis: list[dict]) -> str:
+    images = {}
     for emoji in emojis:
         shortcode = html.escape(emoji.shortcode)
-        content = content.replace(
-            f":{emoji.shortcode}:",
-            f'<img class="emoji" title="{shortcode}" alt="{shortcode}" src="{emoji.url}">',
+        images[emoji.shortcode] = (
+            f'<img class="emoji" title="{shortcode}" alt="{shortcode}" src="{emoji.url}">'
         )
-    return content
+    # one pass over the content for all the emojis, longest shortcodes first so that a
+    # shortcode that is a prefix of another one doesn't win
+    shortcodes = sorted(images, key=len, reverse=True)
+    emoji_re = re.compile(":(" + "|".join(re.escape(shortcode) for shortcode in shortcodes) + "):")
+    return emoji_re.sub(lambda match: images[match.group(1)], content)
 
 
 def format_media(media: dict, media_count: int) -> str:
@@ -47,7 +64,7 @@ def format_media(media: dict, media_count: int) -> str:
         return ""
 
 
-def format_post(post: ScoredPost, mastodon_base_url: str, known_instance_domains: set[str]) -> dict:
+def format_post(post: ScoredPost, mastodon_base_url: str, known_instance_domains: frozenset[str]) -> dict:
     account_avatar = post.account.avatar
     account_url = "https://main.elk.zone/" + post.account.url
     display_name = replace_emojis(post.account.display_name, post.account.emojis)
@@ -74,7 +91,7 @@ def format_post(post: ScoredPost, mastodon_base_url: str, known_instance_domains
         spoiler_text=replace_emojis(post.spoiler_text, post.emojis),
         content=content,
         media=media,
-        is_poll="poll" in post._data and post.poll is not None,
+        is_poll=post.has_poll,
         created_at=created_at,
         home_link=home_link,
         original_link=original_link,
@@ -85,7 +102,48 @@ def format_post(post: ScoredPost, mastodon_base_url: str, known_instance_domains
     )
 
 
+# formatting a post takes about 0.1ms, so a worker process is worth starting only for
+# about this many posts
+PARALLEL_MIN_POST_COUNT = 1000
+
+_worker_mastodon_base_url: str = ""
+_worker_known_instance_domains: frozenset[str] = frozenset()
+
+
+def _init_worker(mastodon_base_url: str, known_instance_domains: frozenset[str]) -> None:
+    # sent once per worker process instead of with every post
+    global _worker_mastodon_base_url, _worker_known_instance_domains
+    _worker_mastodon_base_url = mastodon_base_url
+    _worker_known_instance_domains = known_instance_domains
+
+
+def _format_post_in_worker(post: ScoredPost) -> dict:
+    return format_post(post, _worker_mastodon_base_url, _worker_known_instance_domains)
+
+
 def format_posts(
-    posts: list[ScoredPost], mastodon_base_url: str, known_instance_domains: set[str]
+    posts: list[ScoredPost],
+    mastodon_base_url: str,
+    known_instance_domains: frozenset[str],
+    workers: int = 1,
 ) -> list[dict]:
-    return [format_post(post, mastodon_base_url, known_instance_domains) for post in posts]
+    """Formats the posts for rendering, in `workers` processes for large digests.
+
+    Zero workers means one per CPU core.
+    """
+    workers = min(workers or os.cpu_count() or 1, math.ceil(len(posts) / PARALLEL_MIN_POST_COUNT))
+    if workers <= 1:
+        return [format_post(post, mastodon_base_url, known_instance_domains) for post in posts]
+
+    # forkserver instead of fork, because the process runs other threads at the same time;
+    # the server imports this module once, and workers are forked from it ready to go
+    mp_context = multiprocessing.get_context("forkserver")
+    mp_context.set_forkserver_preload([__name__])
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context,
+        initializer=_init_worker,
+        initargs=(mastodon_base_url, known_instance_domains),
+    ) as executor:
+        chunk_size = math.ceil(len(posts) / (workers * 4))
+        return list(executor.map(_format_post_in_worker, posts, chunksize=chunk_size))
@@ -0,0 +1,284 @@
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from typing import Iterator, Optional
+from urllib.parse import urlparse
+import bisect
+import cProfile
+import io
+import json
+import pstats
+import requests
+import resource
+import shutil
+import tempfile
+import threading
+import time
+
+# upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class DomainRequests:
+    def __init__(self) -> None:
+        self.outcome_counts: defaultdict[str, int] = defaultdict(int)
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.count = 0
+
+    def record(self, seconds: float, outcome: str) -> None:
+        self.outcome_counts[outcome] += 1
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.latency_sum += seconds
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "outcomes": dict(self.outcome_counts),
+            "latency_sum_seconds": round(self.latency_sum, 6),
+            "latency_buckets": {
+                str(bound): count
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.bucket_counts)
+            },
+        }
+
+
+class RunMetrics:
+    """Collects where the time, requests and memory of a run go.
+
+    Stage times add up when a stage runs many times, or for many accounts at once in a
+    batch. Requests are recorded by the HTTP adapter of the sessions from `make_session`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._stage_seconds: defaultdict[str, float] = defaultdict(float)
+        self._stage_peak_rss: dict[str, int] = {}
+        self._requests: defaultdict[str, DomainRequests] = defaultdict(DomainRequests)
+        self._cache_lookups: defaultdict[str, dict[str, int]] = defaultdict(
+            lambda: {"hit": 0, "miss": 0}
+        )
+        self._counts: defaultdict[str, int] = defaultdict(int)
+        # set to profile every stage too
+        self.profiler: Optional[StageProfiler] = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        profile = self.profiler.profile(name) if self.profiler else nullcontext()
+        started_at = time.perf_counter()
+        try:
+            with profile:
+                yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            with self._lock:
+                self._stage_seconds[name] += elapsed
+                self._stage_peak_rss[name] = peak_rss_bytes()
+
+    def record_request(self, domain: str, seconds: float, outcome: str) -> None:
+        with self._lock:
+            self._requests[domain].record(seconds, outcome)
+
+    def record_cache_lookup(self, cache: str, hit: bool) -> None:
+        with self._lock:
+            self._cache_lookups[cache]["hit" if hit else "miss"] += 1
+
+    def add_count(self, name: str, count: int) -> None:
+        with self._lock:
+            self._counts[name] += count
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "started_at": self._started_at,
+                "duration_seconds": round(time.time() - self._started_at, 3),
+                "peak_rss_bytes": peak_rss_bytes(),
+                "stages": {
+                    name: {
+                        "seconds": round(seconds, 6),
+                        "peak_rss_bytes": self._stage_peak_rss[name],
+                    }
+                    for name, seconds in self._stage_seconds.items()
+                },
+                "requests": {
+                    domain: domain_requests.to_dict()
+                    for domain, domain_requests in self._requests.items()
+                },
+                "caches": {
+                    cache: lookups
+                    | {
+                        "hit_rate": lookups["hit"] / (lookups["hit"] + lookups["miss"])
+                        if lookups["hit"] + lookups["miss"] > 0
+                        else 0.0
+                    }
+                    for cache, lookups in self._cache_lookups.items()
+                },
+                "counts": dict(self._counts),
+            }
+
+    def write_json(self, path: str) -> None:
+        _write_atomically(path, json.dumps(self.report(), indent=2))
+        print(f"Wrote run report: {path}")
+
+    def write_prometheus(self, path: str) -> None:
+        """Writes the metrics in the Prometheus text format, e.g. for the textfile collector
+        of the node exporter"""
+        report = self.report()
+        lines = []
+
+        def metric(name: str, kind: str, description: str) -> None:
+            lines.append(f"# HELP mastodon_digest_{name} {description}")
+            lines.append(f"# TYPE mastodon_digest_{name} {kind}")
+
+        def sample(metric_name: str, value: float, **labels: str) -> None:
+            label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+            label_text = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"mastodon_digest_{metric_name}{label_text} {value}")
+
+        metric("run_duration_seconds", "gauge", "Wall time of the run.")
+        sample("run_duration_seconds", report["duration_seconds"])
+        metric("run_finished_timestamp_seconds", "gauge", "When the run finished.")
+        sample("run_finished_timestamp_seconds", round(time.time(), 3))
+        metric("peak_rss_bytes", "gauge", "Peak resident memory of the run.")
+        sample("peak_rss_bytes", report["peak_rss_bytes"])
+
+        metric("stage_duration_seconds", "gauge", "Time spent in a stage of the run.")
+        for stage, values in report["stages"].items():
+            sample("stage_duration_seconds", values["seconds"], stage=stage)
+        metric("stage_peak_rss_bytes", "gauge", "Peak resident memory at the end of a stage.")
+        for stage, values in report["stages"].items():
+            sample("stage_peak_rss_bytes", values["peak_rss_bytes"], stage=stage)
+
+        metric("requests_total", "counter", "HTTP requests by domain and outcome.")
+        for domain, values in report["requests"].items():
+            for outcome, count in values["outcomes"].items():
+                sample("requests_total", count, domain=domain, outcome=outcome)
+        metric("request_duration_seconds", "histogram", "Latency of HTTP requests by domain.")
+        for domain, values in report["requests"].items():
+            cumulative_count = 0
+            for bound, count in values["latency_buckets"].items():
+                cumulative_count += count
+                sample("request_duration_seconds_bucket", cumulative_count, domain=domain, le=bound)
+            sample("request_duration_seconds_sum", values["latency_sum_seconds"], domain=domain)
+            sample("request_duration_seconds_count", values["count"], domain=domain)
+
+        metric("cache_lookups_total", "counter", "Cache lookups by cache and result.")
+        for cache, values in report["caches"].items():
+            for result in ("hit", "miss"):
+                sample("cache_lookups_total", values[result], cache=cache, result=result)
+
+        metric("items_total", "counter", "Numbers of things the run handled.")
+        for name, count in report["counts"].items():
+            sample("items_total", count, name=name)
+
+        _write_atomically(path, "\n".join(lines) + "\n")
+        print(f"Wrote Prometheus metrics: {path}")
+
+
+class StageProfiler:
+    """Profiles the stages of a run with cProfile.
+
+    cProfile only sees the thread a stage runs in, so work handed to the enrichment
+    workers or the formatting processes shows up as the time spent waiting for it. A
+    stage that runs many times, or in many threads of a batch, adds up into one profile.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles: defaultdict[str, list[cProfile.Profile]] = defaultdict(list)
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        # only one profiler can be active in a thread, so nested stages go to the outer one
+        if getattr(self._local, "active", False):
+            yield
+            return
+
+        profiles = self._local.__dict__.setdefault("profiles", {})
+        if name not in profiles:
+            profiles[name] = cProfile.Profile()
+            with self._lock:
+                self._profiles[name].append(profiles[name])
+
+        self._local.active = True
+        profiles[name].enable()
+        try:
+            yield
+        finally:
+            profiles[name].disable()
+            self._local.active = False
+
+    def write(self, directory: str, top: int) -> None:
+        """Writes a <stage>.prof dump per stage, for pstats or snakeviz, and summary.txt
+        with the `top` functions of every stage by own time and by cumulative time"""
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        summary = io.StringIO()
+        with self._lock:
+            for name, profiles in self._profiles.items():
+                stats = pstats.Stats(*profiles, stream=summary)
+                stats.dump_stats(path / f"{name}.prof")
+                for sort_key in ("tottime", "cumulative"):
+                    summary.write(f"=== {name} by {sort_key} ===\n")
+                    stats.sort_stats(sort_key).print_stats(top)
+
+        _write_atomically(str(path / "summary.txt"), summary.getvalue())
+        print(f"Wrote profiles of {len(self._profiles)} stages: {path}")
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    """Records the latency and outcome of every request in `run_metrics`"""
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        domain = urlparse(request.url).netloc
+        started_at = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception as e:
+            run_metrics.record_request(domain, time.perf_counter() - started_at, type(e).__name__)
+            raise
+        outcome = f"{response.status_code // 100}xx"
+        run_metrics.record_request(domain, time.perf_counter() - started_at, outcome)
+        return response
+
+
+def make_session(
+    pool_connections: int = 10, pool_maxsize: int = 10, pool_block: bool = False
+) -> requests.Session:
+    """A session with a keep-alive connection pool for each of up to `pool_connections`
+    hosts, each keeping up to `pool_maxsize` connections. With `pool_block`, requests wait
+    for a free connection instead of opening more than that to a host."""
+    session = requests.Session()
+    adapter = InstrumentedHTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomically(path: str, text: str) -> None:
+    with tempfile.NamedTemporaryFile(
+        "w", prefix="mastodon_digest_metrics", suffix=".tmp", delete=False
+    ) as f:
+        f.write(text)
+        tempPath = f.name
+
+    shutil.move(tempPath, path)
+
+
+# the metrics of the whole process, shared by all the accounts of a batch
+run_metrics = RunMetrics()
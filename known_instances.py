@@ -0,0 +1,116 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from config import Config
+from instrumentation import make_session, run_metrics
+from typing import Optional
+from urllib.parse import urlparse
+import json
+import os
+import requests
+import shutil
+import tempfile
+import time
+
+NODES_URL = "https://nodes.fediverse.party/nodes.json"
+
+
+def get_known_instance_domains(config: Config) -> frozenset[str]:
+    """Returns the domains of known fediverse instances.
+
+    The list is cached in a file, and downloaded again only when the cache is older than
+    `cache_known_instances_max_age_hours`, and then only if it has changed since. If the
+    download fails, the cached list is used however old it is.
+    """
+    cached = _load(config.cache_known_instances_file)
+    if cached is not None and (
+        time.time() - cached["fetched_at"] < config.cache_known_instances_max_age_hours * 3600
+    ):
+        print(f"Using {len(cached['domains'])} cached known instance domains")
+        run_metrics.record_cache_lookup("known_instances", True)
+        return frozenset(cached["domains"])
+
+    headers = {}
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    try:
+        with make_session() as session, session.get(NODES_URL, headers=headers, timeout=30) as resp:
+            run_metrics.record_cache_lookup(
+                "known_instances", resp.status_code == 304 and cached is not None
+            )
+            if resp.status_code == 304 and cached is not None:
+                print(f"Known instance domains not modified: {len(cached['domains'])} domains")
+                cached["fetched_at"] = time.time()
+                _save(cached, config.cache_known_instances_file)
+                return frozenset(cached["domains"])
+
+            resp.raise_for_status()
+            domains = resp.json()
+            assert type(domains) == list
+            cached = {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+                "domains": sorted(set(domain.lower() for domain in domains)),
+            }
+    except (requests.exceptions.RequestException, ValueError, AssertionError) as err:
+        print("Error in getting fediverse nodes.json", err)
+        if cached is None:
+            return frozenset()
+        print(f"Using {len(cached['domains'])} stale cached known instance domains")
+        return frozenset(cached["domains"])
+
+    _save(cached, config.cache_known_instances_file)
+    print(f"Downloaded {len(cached['domains'])} known instance domains")
+    return frozenset(cached["domains"])
+
+
+def get_cached_known_instance_domains(config: Config) -> frozenset[str]:
+    """Returns the cached domains of known fediverse instances however old, without any
+    requests"""
+    cached = _load(config.cache_known_instances_file)
+    if cached is None:
+        return frozenset()
+    return frozenset(cached["domains"])
+
+
+def prefetch_known_instance_domains(config: Config) -> Future[frozenset[str]]:
+    """Gets the known instance domains in the background, as they are only needed to format
+    the digest"""
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="known_instances")
+    known_instance_domains = executor.submit(get_known_instance_domains, config)
+    executor.shutdown(wait=False)
+    return known_instance_domains
+
+
+def is_known_instance_url(url: str, known_instance_domains: frozenset[str]) -> bool:
+    try:
+        hostname = urlparse(url).hostname
+    except ValueError:
+        return False
+    return hostname is not None and hostname in known_instance_domains
+
+
+def _load(path: str) -> Optional[dict]:
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r") as f:
+        try:
+            cached = json.load(f)
+            assert type(cached) == dict
+        except (json.JSONDecodeError, AssertionError):
+            return None
+    return cached
+
+
+def _save(cached: dict, path: str) -> None:
+    with tempfile.NamedTemporaryFile(
+        "w", prefix="mastodon_digest_known_instances", suffix=".json", delete=False
+    ) as f:
+        json.dump(cached, f)
+        tempPath = f.name
+
+    shutil.move(tempPath, path)
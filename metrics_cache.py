@@ -0,0 +1,147 @@
+from collections import defaultdict
+from config import Config
+from datetime import datetime, timedelta, timezone
+from instrumentation import run_metrics
+from models import PostMetrics
+from typing import Optional
+import sqlite3
+import threading
+import time
+
+
+class MetricsCache:
+    """On-disk cache of post metrics fetched from the posts' origin instances.
+
+    A cached entry expires after a fraction of the post's age at the time it was fetched,
+    clamped between the configured minimum and maximum TTL, so metrics of fresh posts are
+    refreshed often and those of old posts rarely. Also caches the status ids that
+    ActivityPub object URLs of posts redirect to, which never change.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self._config = config
+        self._min_ttl = config.cache_metrics_min_ttl_minutes * 60
+        self._max_ttl = config.cache_metrics_max_ttl_hours * 60 * 60
+        self._lock = threading.Lock()
+        self._stats = defaultdict(int)
+        self._connection = sqlite3.connect(config.cache_metrics_file, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS post_metrics (
+                url TEXT PRIMARY KEY,
+                replies_count INTEGER NOT NULL,
+                reblogs_count INTEGER NOT NULL,
+                favourites_count INTEGER NOT NULL,
+                followers_count INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS post_metrics_fetched_at ON post_metrics (fetched_at)"
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS post_status_ids (
+                url TEXT PRIMARY KEY,
+                status_id TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.commit()
+
+    def get(self, url: str, record: bool = True) -> Optional[PostMetrics]:
+        """Returns the cached metrics of the post. Looking up again a post that was already
+        looked up shouldn't count towards the hit rate, so pass `record=False` then."""
+        with self._lock:
+            row = self._connection.execute(
+                """
+                SELECT replies_count, reblogs_count, favourites_count, followers_count
+                FROM post_metrics WHERE url = ? AND expires_at > ?
+                """,
+                (url, time.time()),
+            ).fetchone()
+
+            if record:
+                run_metrics.record_cache_lookup("metrics", row is not None)
+                self._stats["hit_count" if row is not None else "miss_count"] += 1
+            return PostMetrics(*row) if row is not None else None
+
+    def put(self, url: str, created_at: datetime, metrics: PostMetrics) -> None:
+        now = time.time()
+        age = now - created_at.timestamp()
+        ttl = min(self._max_ttl, max(self._min_ttl, age * self._config.cache_metrics_ttl_age_frac))
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO post_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    metrics.replies_count,
+                    metrics.reblogs_count,
+                    metrics.favourites_count,
+                    metrics.followers_count,
+                    created_at.timestamp(),
+                    now,
+                    now + ttl,
+                ),
+            )
+            self._stats["write_count"] += 1
+
+    def get_status_id(self, url: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status_id FROM post_status_ids WHERE url = ?", (url,)
+            ).fetchone()
+
+            run_metrics.record_cache_lookup("status_ids", row is not None)
+            if row is None:
+                self._stats["status_id_miss_count"] += 1
+                return None
+
+            self._stats["status_id_hit_count"] += 1
+            return row[0]
+
+    def put_status_id(self, url: str, created_at: datetime, status_id: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO post_status_ids VALUES (?, ?, ?)",
+                (url, status_id, created_at.timestamp()),
+            )
+
+    def close(self) -> None:
+        """Evicts entries that are no longer useful and writes the cache to disk"""
+        min_post_created_at = datetime.now(timezone.utc) - timedelta(
+            hours=self._config.post_max_age_hours
+        )
+        with self._lock:
+            # posts older than the max post age are filtered out before enrichment
+            cursor = self._connection.execute(
+                "DELETE FROM post_metrics WHERE created_at < ?",
+                (min_post_created_at.timestamp(),),
+            )
+            self._stats["evicted_count"] += cursor.rowcount
+            self._connection.execute(
+                "DELETE FROM post_status_ids WHERE created_at < ?",
+                (min_post_created_at.timestamp(),),
+            )
+            cursor = self._connection.execute(
+                """
+                DELETE FROM post_metrics WHERE url IN (
+                    SELECT url FROM post_metrics ORDER BY fetched_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self._config.cache_metrics_max_entries,),
+            )
+            self._stats["evicted_count"] += cursor.rowcount
+            self._connection.commit()
+            self._connection.close()
+
+    def print_stats(self) -> None:
+        lookup_count = self._stats["hit_count"] + self._stats["miss_count"]
+        hit_rate = self._stats["hit_count"] / lookup_count if lookup_count > 0 else 0.0
+        print(f"Metrics cache hit rate {hit_rate:.0%}:")
+        for key, val in self._stats.items():
+            print(f"    {key} = {val}")
@@ -1,75 +1,330 @@
+from collections import defaultdict
 from config import Config
+from content import Link, ParsedContent, parse_content
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from mastodon import Mastodon, MastodonVersionError
-from scorers import Scorer
-from typing import Any, ClassVar
+from domain_health import DomainHealth, parse_retry_after
+from instrumentation import make_session
+from mastodon import (
+    Mastodon,
+    MastodonAPIError,
+    MastodonNetworkError,
+    MastodonNotFoundError,
+    MastodonRatelimitError,
+    MastodonServerError,
+    MastodonUnauthorizedError,
+)
+from near_duplicates import minhash
+from scorers import ScoreColumns, Scorer
+from typing import ClassVar, NamedTuple, Optional
 from urllib.parse import urlparse
+import numpy as np
 import requests
+import sys
+import threading
+
+
+@dataclass
+class PostMetrics:
+    replies_count: int
+    reblogs_count: int
+    favourites_count: int
+    followers_count: int
+
+
+class PostEmoji(NamedTuple):
+    shortcode: str
+    url: str
+
+
+class PostMedia(NamedTuple):
+    type: str
+    url: str
+    description: Optional[str]
+
+
+class PostAccount:
+    __slots__ = (
+        "acct",
+        "username",
+        "display_name",
+        "url",
+        "avatar",
+        "bot",
+        "group",
+        "followers_count",
+        "emojis",
+    )
+
+    def __init__(self, account: dict) -> None:
+        self.acct: str = sys.intern(account.acct)
+        self.username: str = account.username
+        self.display_name: str = account.display_name
+        self.url: str = account.url
+        self.avatar: str = account.avatar
+        self.bot: bool = bool(account.bot)
+        self.group: bool = bool(account.group)
+        self.followers_count: int = account.followers_count
+        self.emojis = tuple(PostEmoji(e.shortcode, e.url) for e in account.emojis)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PostAccount":
+        account = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(account, name, data[name])
+        account.acct = sys.intern(account.acct)
+        account.emojis = tuple(PostEmoji(*emoji) for emoji in account.emojis)
+        return account
 
 
 class ScoredPost:
+    """A post from the timeline.
+
+    Keeps only the fields that scoring, thresholding and rendering need, so that the full
+    API payloads of thousands of posts don't have to stay in memory for the whole run.
+    """
+
+    __slots__ = (
+        "id",
+        "url",
+        "origin_domain",
+        "visibility",
+        "content",
+        "created_at",
+        "in_reply_to_id",
+        "sensitive",
+        "spoiler_text",
+        "tags",
+        "has_poll",
+        "emojis",
+        "media_attachments",
+        "account",
+        "replies_count",
+        "reblogs_count",
+        "favourites_count",
+        "timeline_at",
+        "score",
+        "minhash",
+        "content_fingerprint",
+        "_links",
+    )
+
     mastodon_client_cache: ClassVar[dict[str, Mastodon]] = {}
-    bad_domains = {
-        "tech.lgbt",
-        "bsd.network",
-        "pixelfed.social",
-    }
-
-    def __init__(self, data: dict):
-        self._data = data
+    mastodon_client_locks: ClassVar[defaultdict[str, threading.Lock]] = defaultdict(
+        threading.Lock
+    )
+    # the connections to remote instances, shared by their clients and the status id
+    # lookups, so that a request reuses the connection of any earlier one to the instance
+    remote_session: ClassVar[requests.Session] = make_session()
+
+    def __init__(
+        self,
+        status: dict,
+        parsed_content: Optional[ParsedContent] = None,
+        timeline_at: Optional[datetime] = None,
+        min_word_count: int = 1,
+    ):
+        """`min_word_count` is the number of words below which the post gets no MinHash
+        signature, and can't be a near-duplicate of another post"""
+        self.id: int = status.id
+        self.url: str = status.url
+        self.origin_domain: str = sys.intern(urlparse(status.url).netloc)
+        self.visibility: str = sys.intern(status.visibility)
+        self.content: str = status.content
+        self.created_at: datetime = status.created_at
+        self.in_reply_to_id: Optional[int] = status.in_reply_to_id
+        self.sensitive: bool = bool(status.sensitive)
+        self.spoiler_text: str = status.spoiler_text
+        self.tags = tuple(sys.intern(tag.name.lower()) for tag in status.tags)
+        self.has_poll: bool = status.get("poll") is not None
+        self.emojis = tuple(PostEmoji(e.shortcode, e.url) for e in status.emojis)
+        self.media_attachments = tuple(
+            PostMedia(sys.intern(m.type), m.url, m.description) for m in status.media_attachments
+        )
+        self.account = PostAccount(status.account)
+        self.replies_count: int = status.replies_count
+        self.reblogs_count: int = status.reblogs_count
+        self.favourites_count: int = status.favourites_count
+        # when the post showed up in the timeline, which is later than its creation for boosts
+        self.timeline_at: datetime = timeline_at or status.created_at
         self.score = 0.0
+        self.minhash: Optional[bytes] = (
+            minhash(
+                parsed_content.words,
+                min_word_count,
+                [media.url for media in self.media_attachments]
+                + [link.href for link in parsed_content.non_mention_links],
+            )
+            if parsed_content is not None
+            else None
+        )
+        # of the content key the duplicate filter saw, to catch copies of carried posts
+        self.content_fingerprint: Optional[int] = None
+        self._links = parsed_content.links if parsed_content is not None else None
+
+    def to_dict(self) -> dict:
+        """Returns the post as a JSON serializable dict"""
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["created_at"] = self.created_at.isoformat()
+        data["timeline_at"] = self.timeline_at.isoformat()
+        data["account"] = self.account.to_dict()
+        data["minhash"] = self.minhash.hex() if self.minhash is not None else None
+        data["_links"] = (
+            [[link.href, link.is_mention] for link in self._links]
+            if self._links is not None
+            else None
+        )
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ScoredPost":
+        post = cls.__new__(cls)
+        for name in cls.__slots__:
+            # the optional fields added since the post was saved are None
+            setattr(post, name, data.get(name))
+        post.origin_domain = sys.intern(post.origin_domain)
+        post.visibility = sys.intern(post.visibility)
+        post.created_at = datetime.fromisoformat(post.created_at)
+        post.timeline_at = datetime.fromisoformat(post.timeline_at)
+        post.tags = tuple(sys.intern(tag) for tag in post.tags)
+        post.emojis = tuple(PostEmoji(*emoji) for emoji in post.emojis)
+        post.media_attachments = tuple(PostMedia(*media) for media in post.media_attachments)
+        post.account = PostAccount.from_dict(post.account)
+        if post.minhash is not None:
+            post.minhash = bytes.fromhex(post.minhash)
+        if post._links is not None:
+            post._links = tuple(Link(*link) for link in post._links)
+        return post
 
-    def __getattr__(self, name: str) -> Any:
-        return self._data[name]
+    @property
+    def links(self) -> tuple[Link, ...]:
+        if self._links is None:
+            self._links = parse_content(self.content).links
+        return self._links
 
     def set_content(self, content: str) -> None:
-        self._data["content"] = content
+        self.content = content
+        self._links = None
 
-    def fetch_metrics(self) -> bool:
+    @property
+    def origin_api_base_url(self) -> str:
+        url_parts = urlparse(self.url)
+        return f"{url_parts.scheme}://{url_parts.netloc}"
+
+    def needs_status_id_resolution(self) -> bool:
+        """Whether the post URL is an ActivityPub object URL that redirects to the status"""
+        url_path_parts = urlparse(self.url).path.split("/")
+        return len(url_path_parts) > 1 and url_path_parts[1] == "objects"
+
+    def set_metrics(self, metrics: PostMetrics) -> None:
+        self.replies_count = metrics.replies_count
+        self.reblogs_count = metrics.reblogs_count
+        self.favourites_count = metrics.favourites_count
+        self.account.followers_count = metrics.followers_count
+
+    def resolve_status_id(self, domain_health: DomainHealth) -> Optional[str]:
+        """Finds the id of the post on its origin instance"""
+        if not self.needs_status_id_resolution():
+            return urlparse(self.url).path.split("/")[-1]
+
+        domain = self.origin_domain
+        if not domain_health.is_available(domain):
+            return None
+
+        try:
+            resp = ScoredPost.remote_session.head(self.url, timeout=30)
+            if resp.status_code in (429, 503):
+                domain_health.record_rate_limited(
+                    domain, parse_retry_after(resp.headers.get("retry-after"))
+                )
+                return None
+            return resp.headers["location"].split("/")[-1]
+        except Exception as e:
+            return _handle_remote_error(self.url, domain, e, domain_health)
+
+    def fetch_metrics(self, domain_health: DomainHealth, status_id: str) -> Optional[PostMetrics]:
+        """Fetches the metrics of the post from its origin instance.
+
+        Safe to call from worker threads; the caller applies the result with `set_metrics`.
+        """
         if self.visibility == "private":
-            return False
+            return None
+
+        domain = self.origin_domain
+        if not domain_health.is_available(domain):
+            return None
+
+        mastodon_client = ScoredPost.get_mastodon_client(self.origin_api_base_url, domain_health)
+        if mastodon_client is None:
+            return None
 
         try:
-            url_parts = urlparse(self.url)
-            if url_parts.netloc in ScoredPost.bad_domains:
-                return False
-
-            mastodon_client = self._create_mastodon_client(url_parts)
-            if mastodon_client is None:
-                return False
-
-            url_path_parts = url_parts.path.split("/")
-            post_id = url_path_parts[-1]
-            if url_path_parts[1] == "objects":
-                post_url = requests.head(self.url).headers["location"]
-                post_id = post_url.split("/")[-1]
-
-            status = mastodon_client.status(post_id)
-            self._data["replies_count"] = status.replies_count
-            self._data["reblogs_count"] = status.reblogs_count
-            self._data["favourites_count"] = status.favourites_count
-            self._data["account"]["followers_count"] = status.account.followers_count
-            return True
+            status = mastodon_client.status(status_id)
+            domain_health.record_success(domain)
+            if mastodon_client.ratelimit_remaining <= 1:
+                domain_health.record_rate_limited(domain, mastodon_client.ratelimit_reset)
+
+            return PostMetrics(
+                replies_count=status.replies_count,
+                reblogs_count=status.reblogs_count,
+                favourites_count=status.favourites_count,
+                followers_count=status.account.followers_count,
+            )
         except Exception as e:
-            print("An error occurred while enriching post: {0} {1}".format(self.url, e))
-            return False
-
-    def _create_mastodon_client(self, url_parts: list[str]) -> Mastodon:
-        api_base_url = f"{url_parts.scheme}://{url_parts.netloc}"
-        if api_base_url in ScoredPost.mastodon_client_cache:
-            return ScoredPost.mastodon_client_cache[api_base_url]
-        else:
-            mastodon_client = Mastodon(api_base_url=api_base_url, request_timeout=30)
+            return _handle_remote_error(self.url, domain, e, domain_health, mastodon_client)
+
+    @classmethod
+    def configure_remote_session(cls, config: Config) -> None:
+        """Limits the connections to remote instances. Must be called before any clients
+        of remote instances are made, as they keep the session they were made with."""
+        cls.remote_session.close()
+        cls.remote_session = make_session(
+            pool_connections=config.http_max_hosts,
+            pool_maxsize=config.http_max_connections_per_host,
+            pool_block=True,
+        )
+
+    @classmethod
+    def get_mastodon_client(
+        cls, api_base_url: str, domain_health: DomainHealth
+    ) -> Optional[Mastodon]:
+        """Returns a client for the instance, probing it the first time"""
+        if api_base_url in cls.mastodon_client_cache:
+            return cls.mastodon_client_cache[api_base_url]
+
+        domain = urlparse(api_base_url).netloc
+        # only one thread probes an instance, the others wait for its result
+        with cls.mastodon_client_locks[api_base_url]:
+            if api_base_url in cls.mastodon_client_cache:
+                return cls.mastodon_client_cache[api_base_url]
+            if not domain_health.is_available(domain):
+                return None
+
+            # throw instead of sleeping on rate limits so that one instance can't block workers,
+            # and skip the version check, which would request the instance a second time and
+            # swallow its errors; the probe below finds out whether it is there
+            mastodon_client = Mastodon(
+                api_base_url=api_base_url,
+                request_timeout=30,
+                ratelimit_method="throw",
+                version_check_mode="none",
+                session=cls.remote_session,
+            )
             try:
                 mastodon_client.instance()
-                ScoredPost.mastodon_client_cache[api_base_url] = mastodon_client
+                domain_health.record_success(domain)
+                cls.mastodon_client_cache[api_base_url] = mastodon_client
                 return mastodon_client
-            except MastodonVersionError:
-                ScoredPost.bad_domains.add(url_parts.netloc)
-                return None
+            except Exception as e:
+                return _handle_remote_error(
+                    api_base_url, domain, e, domain_health, mastodon_client, probe=True
+                )
 
     def get_home_url(self, mastodon_base_url: str) -> str:
-        return f"{mastodon_base_url}/@{self.account['acct']}/{self.id}"
+        return f"{mastodon_base_url}/@{self.account.acct}/{self.id}"
 
     def calc_score(
         self,
@@ -77,20 +332,18 @@ class ScoredPost:
         config: Config,
         scorer: Scorer,
     ) -> None:
-        self.score = scorer.score(self._data)
-        tags = [tag.name.lower() for tag in self.tags]
+        """Scores this post. Reference implementation of `calc_scores`."""
+        self.score = scorer.score(self)
+        tags = self.tags
         tag_count_threshold = config.scoring_tag_count_threshold - 1
         if self.score > 0:
             if len(tags) > tag_count_threshold:
                 self.score = self.score / ((len(tags) - tag_count_threshold) ** 0.5)
-            if any((t in config.digest_boosted_tags) for t in tags):
-                self.score = self.score * config.scoring_tag_boost
-            if any((t in config.digest_unboosted_tags) for t in tags):
-                self.score = self.score / config.scoring_tag_boost
-            if self._data['in_reply_to_id'] is not None:
-              self.score = self.score / config.scoring_reply_unboost
-            if self._data['account']['bot']:
-              self.score = self.score / config.scoring_bot_unboost
+            self.score = self.score * config.tag_rules.multiplier(tags)
+            if self.in_reply_to_id is not None:
+                self.score = self.score / config.scoring_reply_unboost
+            if self.account.bot:
+                self.score = self.score / config.scoring_bot_unboost
             if config.scoring_halflife_hours > 0:
                 self.score = self.score * (
                     0.5
@@ -101,3 +354,74 @@ class ScoredPost:
                 )
             if self.account.acct in boosted_accounts:
                 self.score = config.scoring_account_boost * self.score
+
+
+def calc_scores(
+    posts: list[ScoredPost],
+    boosted_accounts: set[str],
+    config: Config,
+    scorer: Scorer,
+) -> None:
+    """Scores all the posts at once, with the same result as calling `calc_score` on each"""
+    if not posts:
+        return
+
+    scores = scorer.score_batch(ScoreColumns.from_posts(posts))
+
+    tags = [p.tags for p in posts]
+    tag_counts = np.array([len(post_tags) for post_tags in tags], dtype=np.float64)
+    tag_multipliers = config.tag_rules.multipliers(tags)
+    is_reply = np.array([p.in_reply_to_id is not None for p in posts])
+    is_bot = np.array([p.account.bot for p in posts])
+    is_boosted_account = np.array([p.account.acct in boosted_accounts for p in posts])
+
+    # every adjustment is a factor, and zero scores stay zero
+    tag_count_threshold = config.scoring_tag_count_threshold - 1
+    excess_tag_counts = np.maximum(tag_counts - tag_count_threshold, 1)
+    scores = scores / np.sqrt(excess_tag_counts)
+    scores = scores * tag_multipliers
+    scores = np.where(is_reply, scores / config.scoring_reply_unboost, scores)
+    scores = np.where(is_bot, scores / config.scoring_bot_unboost, scores)
+    if config.scoring_halflife_hours > 0:
+        # ages from the differences of datetimes, as differences of timestamps lose precision
+        now = datetime.now(timezone.utc)
+        ages = np.array([(now - p.created_at).total_seconds() for p in posts])
+        scores = scores * 0.5 ** (ages / (config.scoring_halflife_hours * 60 * 60))
+    scores = np.where(is_boosted_account, scores * config.scoring_account_boost, scores)
+
+    for post, score in zip(posts, scores):
+        post.score = float(score)
+
+
+def _handle_remote_error(
+    url: str,
+    domain: str,
+    e: Exception,
+    domain_health: DomainHealth,
+    mastodon_client: Optional[Mastodon] = None,
+    probe: bool = False,
+) -> None:
+    if probe and isinstance(e, MastodonNotFoundError):
+        # the instance endpoint is part of every Mastodon API
+        print("Not a Mastodon server: {0} {1}".format(url, e))
+        domain_health.mark_bad(domain)
+    elif isinstance(e, MastodonNotFoundError):
+        # the post is gone, but the server is fine
+        domain_health.record_success(domain)
+    elif isinstance(e, MastodonRatelimitError):
+        domain_health.record_rate_limited(
+            domain, mastodon_client.ratelimit_reset if mastodon_client is not None else None
+        )
+    elif isinstance(e, MastodonUnauthorizedError):
+        # the server doesn't allow unauthenticated access to its API
+        domain_health.mark_bad(domain)
+    elif isinstance(e, (MastodonNetworkError, MastodonServerError, requests.RequestException)):
+        print("An error occurred while enriching post: {0} {1}".format(url, e))
+        domain_health.record_failure(domain)
+    elif probe and isinstance(e, MastodonAPIError):
+        # such as a response that isn't JSON, from a server that isn't Mastodon
+        print("Not a Mastodon server: {0} {1}".format(url, e))
+        domain_health.mark_bad(domain)
+    else:
+        print("An error occurred while enriching post: {0} {1}".format(url, e))
+    return None
@@ -0,0 +1,90 @@
+from collections import defaultdict
+from dedupe import fingerprint
+from typing import Hashable, Iterable, Optional
+from union_find import UnionFind
+import numpy as np
+
+MINHASH_PERMUTATIONS = 64
+# 16 bands of 4 rows make pairs with a Jaccard similarity of about 0.5 or more likely to
+# share a band, which is below any useful similarity threshold
+MINHASH_BANDS = 16
+MINHASH_ROWS = MINHASH_PERMUTATIONS // MINHASH_BANDS
+
+_rng = np.random.default_rng(seed=0x5EED)
+_MULTIPLIERS = _rng.integers(1, 2**64, size=MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_INCREMENTS = _rng.integers(0, 2**64, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def minhash(
+    words: tuple[str, ...], min_word_count: int = 1, attachments: Iterable[str] = ()
+) -> Optional[bytes]:
+    """The MinHash signature of the text, over pairs of adjacent words.
+
+    The fraction of equal values in the signatures of two texts estimates the Jaccard
+    similarity of their word pairs. Returns None for texts of fewer than `min_word_count`
+    words, as a few words make too few pairs to tell different posts apart: the captions
+    "Good morning!" of two different photos would be the same text.
+
+    The word pairs are salted with the `attachments` of the post, such as its media URLs and
+    link hrefs, so that the same caption on different photos or links makes unrelated
+    signatures, while posts with the same attachments compare by their text alone.
+    """
+    if len(words) < max(min_word_count, 1):
+        return None
+
+    words = tuple(word.lower() for word in words)
+    shingles = {" ".join(pair) for pair in zip(words, words[1:])} or set(words)
+    salt = "\x1f".join(sorted(set(attachments)))
+    if salt:
+        shingles = {shingle + "\x1e" + salt for shingle in shingles}
+
+    hashes = np.array([fingerprint(shingle) for shingle in shingles], dtype=np.uint64)
+    # multiply-shift hashing, with the overflow of uint64 as the modulus
+    permuted = (hashes[:, np.newaxis] * _MULTIPLIERS + _INCREMENTS) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32).tobytes()
+
+
+def similarity(signature: bytes, other_signature: bytes) -> float:
+    return float(
+        np.mean(
+            np.frombuffer(signature, dtype=np.uint32)
+            == np.frombuffer(other_signature, dtype=np.uint32)
+        )
+    )
+
+
+class NearDuplicateIndex:
+    """Clusters keys whose MinHash signatures are at least `min_similarity` similar.
+
+    Uses LSH banding to avoid comparing every pair: only keys whose signatures are equal
+    in at least one band of rows are compared. Clusters are transitive, so a chain of
+    near-duplicates is one cluster.
+    """
+
+    def __init__(self, min_similarity: float) -> None:
+        self._min_similarity = min_similarity
+        self._buckets: defaultdict[bytes, list[tuple[Hashable, bytes]]] = defaultdict(list)
+        self._clusters = UnionFind()
+        self.comparison_count = 0
+
+    def add(self, key: Hashable, signature: bytes) -> None:
+        self._clusters.find(key)
+        compared = set()
+        band_size = MINHASH_ROWS * np.dtype(np.uint32).itemsize
+        for band in range(MINHASH_BANDS):
+            # the band number is part of the bucket key, so equal rows in different bands
+            # don't make candidates
+            band_key = bytes([band]) + signature[band * band_size : (band + 1) * band_size]
+            bucket = self._buckets[band_key]
+            for other_key, other_signature in bucket:
+                if other_key in compared:
+                    continue
+                compared.add(other_key)
+                self.comparison_count += 1
+                if similarity(signature, other_signature) >= self._min_similarity:
+                    self._clusters.union(key, other_key)
+            bucket.append((key, signature))
+
+    def clusters(self) -> list[set[Hashable]]:
+        """Returns the clusters with more than one key"""
+        return [cluster for cluster in self._clusters.groups() if len(cluster) > 1]
@@ -1,70 +1,94 @@
-from api import fetch_posts_and_boosts, fetch_boosted_accounts, get_known_instance_domains
+from api import Bootstrap, fetch_posts_and_boosts
+from concurrent.futures import Future
 from config import Config, read_config
+from contextlib import contextmanager
 from datetime import datetime
+from digested_posts import DigestedPostStore
+from domain_health import DomainHealth
 from formatters import format_posts
-from jinja2 import Environment, FileSystemLoader
+from instrumentation import StageProfiler, make_session, run_metrics
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from known_instances import (
+    get_cached_known_instance_domains,
+    prefetch_known_instance_domains,
+)
 from mastodon import Mastodon
+from metrics_cache import MetricsCache
 from pathlib import Path
 from models import ScoredPost
 from scorers import ExtendedSimpleWeightedScorer, Scorer
+from snapshot import Snapshot, load_snapshot, save_snapshot
 from thresholds import Threshold
+from typing import Iterator
 import argparse
 import itertools
-import json
+import math
+import numpy as np
 import os
 import os
 import pprint
-import shutil
 import sys
-import tempfile
 
 
-def render_digest(context: dict, output_dir: Path) -> None:
-    environment = Environment(loader=FileSystemLoader("templates/"))
-    template = environment.get_template("digest.html.jinja")
-    output_html = template.render(context)
-    output_file_path = output_dir / "index.html"
-    output_file_path.write_text(output_html)
-    print(f"Rendered digest: {len(context['posts'])} posts and {len(context['boosts'])} boosts")
+# compiled templates are kept by the environment for the whole process, and their bytecode
+# in the system temp directory across processes
+template_environment = Environment(
+    loader=FileSystemLoader("templates/"),
+    bytecode_cache=FileSystemBytecodeCache(),
+    auto_reload=False,
+)
 
 
-def get_digested_posts(config: Config) -> list[str]:
-    digested_posts_file = config.digest_digested_posts_file
+def render_digest(context: dict, output_dir: Path, posts_per_page: int = 0) -> None:
+    """Renders the digest into index.html, streaming the HTML into the file.
 
-    def createFile():
-        with open(digested_posts_file, "w") as f:
-            f.write("[]")
-            return []
+    With `posts_per_page`, the posts and boosts are split into pages of at most that many
+    of each: index.html, page-2.html, page-3.html and so on.
+    """
+    posts, boosts = context["posts"], context["boosts"]
+    page_size = posts_per_page or max(len(posts), len(boosts), 1)
+    page_count = max(math.ceil(len(posts) / page_size), math.ceil(len(boosts) / page_size), 1)
+    pages = ["index.html"] + [f"page-{page}.html" for page in range(2, page_count + 1)]
 
-    if not os.path.isfile(digested_posts_file):
-        return createFile()
+    # pages left from earlier digests with more pages
+    for stale_page in output_dir.glob("page-*.html"):
+        if stale_page.name not in pages:
+            stale_page.unlink()
 
-    with open(digested_posts_file, "r") as f:
-        try:
-            post_urls = json.load(f)
-            assert type(post_urls) == list
-            return post_urls
-        except json.JSONDecodeError:
-            return createFile()
+    template = template_environment.get_template("digest.html.jinja")
+    for page, page_file in enumerate(pages, start=1):
+        start = (page - 1) * page_size
+        stream = template.stream(
+            context
+            | {
+                "posts": posts[start : start + page_size],
+                "boosts": boosts[start : start + page_size],
+                "post_count": len(posts),
+                "boost_count": len(boosts),
+                "page": page,
+                "pages": pages,
+            }
+        )
+        stream.enable_buffering(size=20)
+        stream.dump(str(output_dir / page_file), encoding="utf-8")
+
+    print(
+        f"Rendered digest: {len(posts)} posts and {len(boosts)} boosts "
+        f"in {page_count} page{'s' if page_count > 1 else ''}"
+    )
 
 
 def save_digested_posts(
-    digested_posts: list[str], posts: list[ScoredPost], boosts: list[ScoredPost], config: Config
+    digested_posts: DigestedPostStore,
+    posts: list[ScoredPost],
+    boosts: list[ScoredPost],
 ) -> None:
-    digested_posts.extend(post.url for post in itertools.chain(posts, boosts))
-    digested_posts_count = int(
-        config.timeline_posts_limit * config.post_max_age_hours / config.timeline_hours_limit
+    digested_posts.add(post.url for post in itertools.chain(posts, boosts))
+    expired_count = digested_posts.expire()
+    print(
+        f"Saved {len(posts) + len(boosts)} digested post URLs, "
+        f"forgot {expired_count} old ones, {len(digested_posts)} in total"
     )
-    digested_posts = digested_posts[-digested_posts_count:]
-
-    with tempfile.NamedTemporaryFile(
-        "w", prefix="mastodon_digest_digested_posts", suffix=".json", delete=False
-    ) as f:
-        json.dump(digested_posts, f)
-        tempPath = f.name
-
-    shutil.move(tempPath, config.digest_digested_posts_file)
-    print(f"Saved {len(digested_posts)} digested post URLs")
 
 
 def run(
@@ -73,28 +97,190 @@ def run(
     mastodon_token: str,
     mastodon_base_url: str,
     output_dir: str,
+    snapshot_file: str = "",
 ) -> None:
     print(f"Running with config:")
     pprint.pp(config)
 
+    ScoredPost.configure_remote_session(config)
+    known_instance_domains = prefetch_known_instance_domains(config)
+    domain_health = DomainHealth(config)
+    domain_health.load()
+    metrics_cache = MetricsCache(config)
+    try:
+        build_digest(
+            config,
+            scorer,
+            mastodon_token,
+            mastodon_base_url,
+            output_dir,
+            domain_health,
+            metrics_cache,
+            known_instance_domains,
+            snapshot_file,
+        )
+    finally:
+        metrics_cache.close()
+        domain_health.save()
+    metrics_cache.print_stats()
+    domain_health.print_stats()
+    write_run_metrics(config)
+
+
+def replay(config: Config, scorer: Scorer, snapshot_file: str, output_dir: str) -> None:
+    """Builds the digest from a snapshot of an earlier run, without any requests.
+
+    Only scoring, formatting and rendering run, for trying out the scoring and digest
+    settings. The digested posts aren't updated, so replays don't change what the next
+    real run digests.
+    """
+    print(f"Replaying with config:")
+    pprint.pp(config)
+
+    with run_metrics.stage("load_snapshot"):
+        snapshot = load_snapshot(snapshot_file)
+    print(
+        f"Replaying snapshot of {snapshot.saved_at.isoformat()}: "
+        f"{len(snapshot.posts)} posts and {len(snapshot.boosts)} boosts"
+    )
+    # the same explore posts are sampled in every replay of a snapshot, so that replays with
+    # different settings can be compared
+    np.random.seed(int(snapshot.saved_at.timestamp()))
+
+    threshold_posts, threshold_boosts = select_digest_posts(
+        config, scorer, snapshot.posts, snapshot.boosts, snapshot.boosted_accounts
+    )
+    write_digest(
+        config,
+        scorer,
+        threshold_posts,
+        threshold_boosts,
+        snapshot.mastodon_base_url,
+        get_cached_known_instance_domains(config),
+        output_dir,
+    )
+    write_run_metrics(config)
+
+
+def write_run_metrics(config: Config) -> None:
+    if config.instrumentation_report_file:
+        run_metrics.write_json(config.instrumentation_report_file)
+    if config.instrumentation_prometheus_file:
+        run_metrics.write_prometheus(config.instrumentation_prometheus_file)
+
+
+def add_profile_arguments(arg_parser: argparse.ArgumentParser) -> None:
+    arg_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile every stage of the run with cProfile",
+    )
+    arg_parser.add_argument(
+        "--profile-dir",
+        default="profiles/",
+        help="Output directory for the profiles",
+        type=str,
+    )
+    arg_parser.add_argument(
+        "--profile-top",
+        default=30,
+        help="The number of functions per stage in the profile summary",
+        type=int,
+    )
+
+
+@contextmanager
+def profiling(args: argparse.Namespace) -> Iterator[None]:
+    if not args.profile:
+        yield
+        return
+
+    run_metrics.profiler = StageProfiler()
+    try:
+        yield
+    finally:
+        run_metrics.profiler.write(args.profile_dir, args.profile_top)
+
+
+def build_digest(
+    config: Config,
+    scorer: Scorer,
+    mastodon_token: str,
+    mastodon_base_url: str,
+    output_dir: str,
+    domain_health: DomainHealth,
+    metrics_cache: MetricsCache,
+    known_instance_domains: Future[frozenset[str]],
+    snapshot_file: str = "",
+) -> None:
+    """Builds the digest of one account.
+
+    The domain health, metrics cache and known instance domains are not specific to the
+    account, and can be shared by the digests of many accounts built at the same time. The
+    known instance domains are waited for only when the digest is formatted. With a
+    `snapshot_file`, the fetched posts are saved to it for `replay`.
+    """
     hours = config.timeline_hours_limit
     print(f"Building digest from the past {hours} hours...")
 
-    mastodon_client = Mastodon(
-        access_token=mastodon_token,
-        api_base_url=mastodon_base_url,
-    )
-    non_threshold_posts_frac = config.digest_explore_frac / (1 - config.digest_explore_frac)
+    with run_metrics.stage("bootstrap"):
+        mastodon_client = Mastodon(
+            access_token=mastodon_token,
+            api_base_url=mastodon_base_url,
+            session=make_session(),
+        )
 
-    boosted_accounts = fetch_boosted_accounts(mastodon_client, config.digest_boosted_list_ids)
-    digested_posts = get_digested_posts(config)
-    print(f"Read {len(digested_posts)} digested post URLs")
+        # the account data is requested while the digested posts are loaded and the first
+        # page of the timeline is fetched
+        bootstrap = Bootstrap(mastodon_client, config, config.digest_boosted_list_ids)
+        digested_posts = DigestedPostStore(config)
+        print(f"Found {len(digested_posts)} digested post URLs")
 
     # 1. Fetch all the posts and boosts from our home timeline that we haven't interacted with
-    posts, boosts = fetch_posts_and_boosts(set(digested_posts), mastodon_client, config)
-    known_instance_domains = get_known_instance_domains()
+    posts, boosts = fetch_posts_and_boosts(
+        digested_posts, mastodon_client, domain_health, metrics_cache, config, bootstrap
+    )
+    with run_metrics.stage("bootstrap"):
+        boosted_accounts = bootstrap.boosted_accounts()
+
+    if snapshot_file:
+        with run_metrics.stage("save_snapshot"):
+            snapshot = Snapshot(mastodon_base_url, boosted_accounts, posts, boosts)
+            save_snapshot(snapshot, snapshot_file)
 
     # 2. Score them, and return those that meet our threshold
+    threshold_posts, threshold_boosts = select_digest_posts(
+        config, scorer, posts, boosts, boosted_accounts
+    )
+
+    with run_metrics.stage("save_digested_posts"):
+        save_digested_posts(digested_posts, threshold_posts, threshold_boosts)
+    digested_posts.print_stats()
+    digested_posts.close()
+
+    # 3. Build the digest
+    with run_metrics.stage("known_instances"):
+        known_domains = known_instance_domains.result()
+    write_digest(
+        config,
+        scorer,
+        threshold_posts,
+        threshold_boosts,
+        mastodon_base_url,
+        known_domains,
+        output_dir,
+    )
+
+
+def select_digest_posts(
+    config: Config,
+    scorer: Scorer,
+    posts: list[ScoredPost],
+    boosts: list[ScoredPost],
+    boosted_accounts: set[str],
+) -> tuple[list[ScoredPost], list[ScoredPost]]:
+    """Scores the posts and boosts, and returns those that make it into the digest"""
+    non_threshold_posts_frac = config.digest_explore_frac / (1 - config.digest_explore_frac)
     threshold = Threshold(config.digest_threshold)
     threshold_posts = threshold.posts_meeting_criteria(
         posts,
@@ -111,21 +297,50 @@ def run(
         scorer,
     )
 
-    save_digested_posts(digested_posts, threshold_posts, threshold_boosts, config)
+    run_metrics.add_count("posts", len(posts))
+    run_metrics.add_count("boosts", len(boosts))
+    run_metrics.add_count("digest_posts", len(threshold_posts))
+    run_metrics.add_count("digest_boosts", len(threshold_boosts))
+    return threshold_posts, threshold_boosts
 
-    # 3. Build the digest
-    render_digest(
-        context={
-            "hours": hours,
-            "posts": format_posts(threshold_posts, mastodon_base_url, known_instance_domains),
-            "boosts": format_posts(threshold_boosts, mastodon_base_url, known_instance_domains),
-            "mastodon_base_url": mastodon_base_url,
-            "rendered_at": datetime.utcnow().isoformat() + "Z",
-            "threshold": config.digest_threshold,
-            "scorer": scorer.get_name(),
-        },
-        output_dir=Path(output_dir),
-    )
+
+def write_digest(
+    config: Config,
+    scorer: Scorer,
+    threshold_posts: list[ScoredPost],
+    threshold_boosts: list[ScoredPost],
+    mastodon_base_url: str,
+    known_domains: frozenset[str],
+    output_dir: str,
+) -> None:
+    hours = config.timeline_hours_limit
+    with run_metrics.stage("format"):
+        formatted_posts = format_posts(
+            threshold_posts,
+            mastodon_base_url,
+            known_domains,
+            config.digest_format_workers,
+        )
+        formatted_boosts = format_posts(
+            threshold_boosts,
+            mastodon_base_url,
+            known_domains,
+            config.digest_format_workers,
+        )
+    with run_metrics.stage("render"):
+        render_digest(
+            context={
+                "hours": hours,
+                "posts": formatted_posts,
+                "boosts": formatted_boosts,
+                "mastodon_base_url": mastodon_base_url,
+                "rendered_at": datetime.utcnow().isoformat() + "Z",
+                "threshold": config.digest_threshold,
+                "scorer": scorer.get_name(),
+            },
+            output_dir=Path(output_dir),
+            posts_per_page=config.digest_posts_per_page,
+        )
 
 
 if __name__ == "__main__":
@@ -145,6 +360,21 @@ if __name__ == "__main__":
         help="The path to the config file",
         type=str,
     )
+    arg_parser.add_argument(
+        "--snapshot",
+        default="",
+        dest="snapshot",
+        help="Save the fetched posts to this file, to rerun the digest from with --replay",
+        type=str,
+    )
+    arg_parser.add_argument(
+        "--replay",
+        default="",
+        dest="replay",
+        help="Build the digest from a snapshot file, without fetching anything",
+        type=str,
+    )
+    add_profile_arguments(arg_parser)
 
     args = arg_parser.parse_args()
     config = read_config(args.config)
@@ -153,6 +383,13 @@ if __name__ == "__main__":
     if not output_dir.exists() or not output_dir.is_dir():
         sys.exit(f"Output directory not found: {args.output_dir}")
 
+    if args.replay:
+        if not os.path.isfile(args.replay):
+            sys.exit(f"Snapshot not found: {args.replay}")
+        with profiling(args):
+            replay(config, ExtendedSimpleWeightedScorer(), args.replay, output_dir)
+        sys.exit()
+
     mastodon_token = os.getenv("MASTODON_TOKEN")
     mastodon_base_url = os.getenv("MASTODON_BASE_URL")
 
@@ -161,4 +398,12 @@ if __name__ == "__main__":
     if not mastodon_base_url:
         sys.exit("Missing environment variable: MASTODON_BASE_URL")
 
-    run(config, ExtendedSimpleWeightedScorer(), mastodon_token, mastodon_base_url, output_dir)
+    with profiling(args):
+        run(
+            config,
+            ExtendedSimpleWeightedScorer(),
+            mastodon_token,
+            mastodon_base_url,
+            output_dir,
+            args.snapshot,
+        )
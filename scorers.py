@@ -1,9 +1,35 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from math import sqrt
 from typing import Callable
 from scipy import stats
 import importlib
 import inspect
+import numpy as np
+
+
+@dataclass
+class ScoreColumns:
+    """The metrics of many posts as arrays, one element per post"""
+
+    posts: list
+    reblogs_count: np.ndarray
+    replies_count: np.ndarray
+    favourites_count: np.ndarray
+    followers_count: np.ndarray
+
+    @classmethod
+    def from_posts(cls, posts: list) -> "ScoreColumns":
+        return cls(
+            posts=posts,
+            reblogs_count=np.array([p.reblogs_count for p in posts], dtype=np.float64),
+            replies_count=np.array([p.replies_count for p in posts], dtype=np.float64),
+            favourites_count=np.array([p.favourites_count for p in posts], dtype=np.float64),
+            followers_count=np.array([p.account.followers_count for p in posts], dtype=np.float64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.posts)
 
 
 class Weight(ABC):
@@ -12,12 +38,20 @@ class Weight(ABC):
     def weight(cls, post: dict) -> float:
         pass
 
+    @classmethod
+    def weight_batch(cls, columns: ScoreColumns) -> np.ndarray:
+        return np.array([cls.weight(post) for post in columns.posts], dtype=np.float64)
+
 
 class UniformWeight(Weight):
     @classmethod
     def weight(cls, post: dict) -> float:
         return 1
 
+    @classmethod
+    def weight_batch(cls, columns: ScoreColumns) -> np.ndarray:
+        return np.ones(len(columns))
+
 
 class InverseFollowerWeight(Weight):
     @classmethod
@@ -32,6 +66,11 @@ class InverseFollowerWeight(Weight):
 
         return weight
 
+    @classmethod
+    def weight_batch(cls, columns: ScoreColumns) -> np.ndarray:
+        followers_count = columns.followers_count
+        return np.where(followers_count > 0, 1 / np.sqrt(np.maximum(followers_count, 1)), 0.0)
+
 
 class Scorer(ABC):
     @classmethod
@@ -39,6 +78,12 @@ class Scorer(ABC):
     def score(cls, post: dict) -> float:
         pass
 
+    @classmethod
+    def score_batch(cls, columns: ScoreColumns) -> np.ndarray:
+        """Scores many posts at once. Subclasses should override this with a vectorized
+        version of `score`; this one calls `score` for each post."""
+        return np.array([cls.score(post) for post in columns.posts], dtype=np.float64)
+
     @classmethod
     def get_name(cls) -> str:
         return cls.__name__.replace("Scorer", "")
@@ -61,12 +106,28 @@ class SimpleScorer(UniformWeight, Scorer):
             metric_average = 0.0
         return metric_average * super().weight(post)
 
+    @classmethod
+    def score_batch(cls, columns: ScoreColumns) -> np.ndarray:
+        has_metrics = (columns.reblogs_count != 0) | (columns.favourites_count != 0)
+        metric_average = stats.gmean(
+            [
+                4 * columns.reblogs_count + 1,
+                columns.favourites_count + 1,
+            ],
+            axis=0,
+        )
+        return np.where(has_metrics, metric_average, 0.0) * super().weight_batch(columns)
+
 
 class SimpleWeightedScorer(InverseFollowerWeight, SimpleScorer):
     @classmethod
     def score(cls, post: dict) -> float:
         return super().score(post) * super().weight(post)
 
+    @classmethod
+    def score_batch(cls, columns: ScoreColumns) -> np.ndarray:
+        return super().score_batch(columns) * super().weight_batch(columns)
+
 
 class ExtendedSimpleScorer(UniformWeight, Scorer):
     @classmethod
@@ -86,12 +147,33 @@ class ExtendedSimpleScorer(UniformWeight, Scorer):
             metric_average = 0.0
         return metric_average * super().weight(post)
 
+    @classmethod
+    def score_batch(cls, columns: ScoreColumns) -> np.ndarray:
+        has_metrics = (
+            (columns.reblogs_count != 0)
+            | (columns.favourites_count != 0)
+            | (columns.replies_count != 0)
+        )
+        metric_average = stats.gmean(
+            [
+                4 * columns.reblogs_count + 1,
+                2 * columns.replies_count + 1,
+                columns.favourites_count + 1,
+            ],
+            axis=0,
+        )
+        return np.where(has_metrics, metric_average, 0.0) * super().weight_batch(columns)
+
 
 class ExtendedSimpleWeightedScorer(InverseFollowerWeight, ExtendedSimpleScorer):
     @classmethod
     def score(cls, post: dict) -> float:
         return super().score(post) * super().weight(post)
 
+    @classmethod
+    def score_batch(cls, columns: ScoreColumns) -> np.ndarray:
+        return super().score_batch(columns) * super().weight_batch(columns)
+
 
 def get_scorers() -> dict[str, Callable[[], Scorer]]:
     all_classes = inspect.getmembers(importlib.import_module(__name__), inspect.isclass)
@@ -0,0 +1,55 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from models import ScoredPost
+import gzip
+import json
+import shutil
+import tempfile
+
+
+@dataclass
+class Snapshot:
+    """The fetched and enriched timeline of a run, to score and render it again offline"""
+
+    mastodon_base_url: str
+    boosted_accounts: set[str] = field(default_factory=set)
+    posts: list[ScoredPost] = field(default_factory=list)
+    boosts: list[ScoredPost] = field(default_factory=list)
+    saved_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+def load_snapshot(path: str) -> Snapshot:
+    with gzip.open(path, "rt") as f:
+        snapshot = json.load(f)
+
+    return Snapshot(
+        mastodon_base_url=snapshot["mastodon_base_url"],
+        boosted_accounts=set(snapshot["boosted_accounts"]),
+        posts=[ScoredPost.from_dict(post) for post in snapshot["posts"]],
+        boosts=[ScoredPost.from_dict(post) for post in snapshot["boosts"]],
+        saved_at=datetime.fromisoformat(snapshot["saved_at"]),
+    )
+
+
+def save_snapshot(snapshot: Snapshot, path: str) -> None:
+    with tempfile.NamedTemporaryFile(
+        "wb", prefix="mastodon_digest_snapshot", suffix=".json.gz", delete=False
+    ) as f:
+        with gzip.open(f, "wt") as gz:
+            json.dump(
+                {
+                    "mastodon_base_url": snapshot.mastodon_base_url,
+                    "boosted_accounts": sorted(snapshot.boosted_accounts),
+                    "saved_at": snapshot.saved_at.isoformat(),
+                    "posts": [post.to_dict() for post in snapshot.posts],
+                    "boosts": [post.to_dict() for post in snapshot.boosts],
+                },
+                gz,
+            )
+        tempPath = f.name
+
+    shutil.move(tempPath, path)
+    print(
+        f"Saved snapshot: {len(snapshot.posts)} posts and {len(snapshot.boosts)} boosts "
+        f"to {path}"
+    )
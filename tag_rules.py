@@ -0,0 +1,56 @@
+from typing import Iterable, Mapping
+import numpy as np
+
+
+class TagRules:
+    """Score multipliers of tags, compiled once from the scoring config.
+
+    Boosted tags multiply the score by the tag boost and unboosted tags divide it, unless
+    the tag has an explicit weight. A post gets the largest multiplier above 1 and the
+    smallest below 1 of its tags, so one boosting and one unboosting tag both count, but
+    ten boosting tags count as one.
+    """
+
+    def __init__(
+        self,
+        boosted_tags: Iterable[str],
+        unboosted_tags: Iterable[str],
+        tag_boost: float,
+        tag_weights: Mapping[str, float],
+    ) -> None:
+        weights = {tag: tag_boost for tag in boosted_tags}
+        weights |= {tag: 1 / tag_boost for tag in unboosted_tags}
+        weights |= tag_weights
+        # tag ids index into the weight array; id 0 is the neutral weight of unknown tags
+        self._tag_ids = {tag: i + 1 for i, tag in enumerate(weights)}
+        self._weights = np.array([1.0, *weights.values()], dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self._tag_ids)
+
+    def multiplier(self, tags: Iterable[str]) -> float:
+        boost = 1.0
+        unboost = 1.0
+        for tag in tags:
+            weight = self._weights[self._tag_ids.get(tag, 0)]
+            boost = max(boost, weight)
+            unboost = min(unboost, weight)
+        return float(boost * unboost)
+
+    def multipliers(self, tags_per_post: list[tuple[str, ...]]) -> np.ndarray:
+        """The multipliers of many posts at once, with the same result as `multiplier`"""
+        post_indexes = np.repeat(
+            np.arange(len(tags_per_post)), [len(tags) for tags in tags_per_post]
+        )
+        tag_ids = np.fromiter(
+            (self._tag_ids.get(tag, 0) for tags in tags_per_post for tag in tags),
+            dtype=np.intp,
+            count=len(post_indexes),
+        )
+        weights = self._weights[tag_ids]
+
+        boosts = np.ones(len(tags_per_post))
+        np.maximum.at(boosts, post_indexes, weights)
+        unboosts = np.ones(len(tags_per_post))
+        np.minimum.at(unboosts, post_indexes, weights)
+        return boosts * unboosts
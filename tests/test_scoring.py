@@ -0,0 +1,89 @@
+"""The batch scoring of models.calc_scores must give the same scores as the per-post
+reference implementation, ScoredPost.calc_score"""
+
+from benchmarks.fixtures import make_statuses
+from config import validate_config
+from datetime import datetime, timezone
+from models import ScoredPost, calc_scores
+from pathlib import Path
+from scorers import get_scorers
+import models
+import pytest
+import random
+import tomllib
+
+CONFIG_FILE = Path(__file__).parent.parent / "config.toml"
+NOW = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW.astimezone(tz)
+
+
+def make_config(halflife_hours: int):
+    with open(CONFIG_FILE, "rb") as f:
+        config = tomllib.load(f)
+    config["scoring"] |= {"halflife_hours": halflife_hours, "tag_weights": {"haskell": 1.5}}
+    config["digest"] |= {
+        "boosted_tags": ["compiler", "haskell"],
+        "unboosted_tags": ["running", "astronomy"],
+    }
+    return validate_config(config)
+
+
+def make_posts() -> list[ScoredPost]:
+    random.seed(8)
+    statuses = make_statuses(300, hours=48)
+    for i, status in enumerate(statuses):
+        status["created_at"] = NOW - (datetime.now(timezone.utc) - status["created_at"])
+        if i % 7 == 0:
+            status["in_reply_to_id"] = statuses[i - 1]["id"]
+        if i % 11 == 0:
+            status["account"]["bot"] = True
+        if i % 13 == 0:
+            status["account"]["followers_count"] = 0
+        if i % 17 == 0:
+            # accounts that hide their followers report -1
+            status["account"]["followers_count"] = -1
+        if i % 19 == 0:
+            status["reblogs_count"] = status["favourites_count"] = status["replies_count"] = 0
+    return [ScoredPost(status) for status in statuses]
+
+
+@pytest.fixture(autouse=True)
+def frozen_clock(monkeypatch):
+    monkeypatch.setattr(models, "datetime", FrozenDatetime)
+
+
+@pytest.mark.parametrize("halflife_hours", [1, 6])
+@pytest.mark.parametrize("scorer_name", sorted(get_scorers()))
+def test_calc_scores_matches_calc_score(scorer_name: str, halflife_hours: int) -> None:
+    scorer = get_scorers()[scorer_name]()
+    config = make_config(halflife_hours)
+    posts = make_posts()
+    boosted_accounts = {post.account.acct for post in posts[::5]}
+
+    for post in posts:
+        post.calc_score(boosted_accounts, config, scorer)
+    expected = [post.score for post in posts]
+
+    calc_scores(posts, boosted_accounts, config, scorer)
+
+    assert [post.score for post in posts] == pytest.approx(expected, rel=1e-12, abs=1e-12)
+    # the test covers every adjustment, and both zero and non-zero scores
+    assert any(score == 0 for score in expected)
+    assert any(score > 0 for score in expected)
+
+
+def test_posts_cover_the_adjustments() -> None:
+    config = make_config(6)
+    posts = make_posts()
+    multipliers = [config.tag_rules.multiplier(post.tags) for post in posts]
+    assert any(multiplier > 1 for multiplier in multipliers)
+    assert any(multiplier < 1 for multiplier in multipliers)
+    assert any(post.in_reply_to_id is not None for post in posts)
+    assert any(post.account.bot for post in posts)
+    assert any(post.account.followers_count == 0 for post in posts)
+    assert any(post.account.followers_count < 0 for post in posts)
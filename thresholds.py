@@ -1,13 +1,33 @@
 from collections import defaultdict
 from config import Config
 from enum import Enum
+from instrumentation import run_metrics
 from itertools import chain
-from models import ScoredPost
+from models import ScoredPost, calc_scores
+from near_duplicates import NearDuplicateIndex
 from scipy import stats
 from scorers import Scorer
+from union_find import UnionFind
 import numpy as np
 
 
+class ThreadIndex(UnionFind):
+    """Groups posts into reply threads with a union-find over post ids.
+
+    Threads also contain the ids of the posts replied to, even if those posts are not in
+    the timeline. Posts that neither reply nor are replied to are not part of any thread.
+    """
+
+    def __init__(self, posts: list[ScoredPost]) -> None:
+        super().__init__()
+        for post in posts:
+            if post.in_reply_to_id is not None:
+                self.union(post.id, post.in_reply_to_id)
+
+    def threads(self) -> list[set[int]]:
+        return self.groups()
+
+
 class Threshold:
     def __init__(self, value: float) -> None:
         self.value = value
@@ -22,66 +42,48 @@ class Threshold:
     ) -> list[ScoredPost]:
         """Returns a list of ScoredPosts that meet this Threshold with the given Scorer"""
 
-        for p in posts:
-            p.calc_score(boosted_accounts, config, scorer)
-
-        threads = self.group_posts_into_threads(posts)
-        posts = self.choose_highest_scored_thread_posts(posts, threads)
-        posts = self.choose_highest_scored_user_posts(posts, config.timeline_max_user_post_count)
-
-        all_post_scores = [p.score for p in posts]
-        threshold_posts = []
-        non_threshold_posts = []
-        min_score = stats.scoreatpercentile(all_post_scores, per=self.value)
-
-        for p in posts:
-            if p.score >= min_score:
-                threshold_posts.append(p)
-            else:
-                non_threshold_posts.append(p)
-
-        threshold_posts.sort(key=lambda p: p.score, reverse=True)
-
-        non_threshold_posts_sample = []
-        if len(non_threshold_posts) > 0 and non_threshold_post_frac > 0:
-            sample_size = int(non_threshold_post_frac * len(threshold_posts))
-            if sample_size > 0:
-                indices = np.random.choice(len(non_threshold_posts), size=sample_size, replace=False)
-                non_threshold_posts_sample = [non_threshold_posts[i] for i in indices]
+        with run_metrics.stage("scoring"):
+            calc_scores(posts, boosted_accounts, config, scorer)
+
+        if config.dedupe_near_duplicates:
+            with run_metrics.stage("near_duplicates"):
+                posts = self.choose_highest_scored_near_duplicate_posts(
+                    posts, config.dedupe_near_duplicate_similarity
+                )
+
+        with run_metrics.stage("threshold"):
+            threads = self.group_posts_into_threads(posts)
+            posts = self.choose_highest_scored_thread_posts(posts, threads)
+            posts = self.choose_highest_scored_user_posts(
+                posts, config.timeline_max_user_post_count
+            )
+
+            all_post_scores = [p.score for p in posts]
+            threshold_posts = []
+            non_threshold_posts = []
+            min_score = stats.scoreatpercentile(all_post_scores, per=self.value)
+
+            for p in posts:
+                if p.score >= min_score:
+                    threshold_posts.append(p)
+                else:
+                    non_threshold_posts.append(p)
+
+            threshold_posts.sort(key=lambda p: p.score, reverse=True)
+
+            non_threshold_posts_sample = []
+            if len(non_threshold_posts) > 0 and non_threshold_post_frac > 0:
+                sample_size = int(non_threshold_post_frac * len(threshold_posts))
+                if sample_size > 0:
+                    indices = np.random.choice(
+                        len(non_threshold_posts), size=sample_size, replace=False
+                    )
+                    non_threshold_posts_sample = [non_threshold_posts[i] for i in indices]
 
         return threshold_posts + non_threshold_posts_sample
 
     def group_posts_into_threads(self, posts: list[ScoredPost]) -> list[set[int]]:
-        post_reply_to_id_map: dict[int, set[int]] = {}
-
-        for post in posts:
-            if post.in_reply_to_id is not None:
-                post_reply_to_id_map[post.id] = {post.in_reply_to_id}
-
-        while True:
-            changed = False
-            for id, reply_to_ids in post_reply_to_id_map.items():
-                for reply_to_id in reply_to_ids:
-                    if reply_to_id in post_reply_to_id_map:
-                        parents = post_reply_to_id_map[reply_to_id]
-                        for parent in parents:
-                            if not (parent in reply_to_ids):
-                                post_reply_to_id_map[id] = set(reply_to_ids)
-                                post_reply_to_id_map[id].add(parent)
-                                changed = True
-            if not changed:
-                break
-
-        for id in list(post_reply_to_id_map.keys()):
-            if id in post_reply_to_id_map:
-                for reply_to_id in post_reply_to_id_map[id]:
-                    if reply_to_id in post_reply_to_id_map:
-                        del post_reply_to_id_map[reply_to_id]
-
-        for id in post_reply_to_id_map:
-            post_reply_to_id_map[id].add(id)
-
-        return list(post_reply_to_id_map.values())
+        return ThreadIndex(posts).threads()
 
     def choose_highest_scored_thread_posts(
         self, posts: list[ScoredPost], threads: list[set[int]]
@@ -111,6 +113,26 @@ class Threshold:
 
         return list(posts_by_id.values())
 
+    def choose_highest_scored_near_duplicate_posts(
+        self, posts: list[ScoredPost], min_similarity: float
+    ) -> list[ScoredPost]:
+        index = NearDuplicateIndex(min_similarity)
+        for i, post in enumerate(posts):
+            if post.minhash is not None:
+                index.add(i, post.minhash)
+
+        excluded: set[int] = set()
+        clusters = index.clusters()
+        for cluster in clusters:
+            best = max(cluster, key=lambda i: posts[i].score)
+            excluded.update(i for i in cluster if i != best)
+
+        print(
+            f"Excluded {len(excluded)} near-duplicate posts in {len(clusters)} clusters "
+            f"({index.comparison_count} comparisons)"
+        )
+        return [post for i, post in enumerate(posts) if i not in excluded]
+
     def choose_highest_scored_user_posts(
         self, posts: list[ScoredPost], max_post_count: int
     ) -> list[ScoredPost]:
@@ -0,0 +1,58 @@
+from config import Config
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from models import ScoredPost
+from typing import Optional
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+
+@dataclass
+class TimelineState:
+    """The filtered and enriched timeline posts of the last run, for incremental runs"""
+
+    newest_status_id: Optional[int] = None
+    posts: list[ScoredPost] = field(default_factory=list)
+    boosts: list[ScoredPost] = field(default_factory=list)
+
+
+def load_timeline_state(config: Config) -> TimelineState:
+    state_file = config.timeline_state_file
+    if not os.path.isfile(state_file):
+        return TimelineState()
+
+    with gzip.open(state_file, "rt") as f:
+        try:
+            state = json.load(f)
+            assert type(state) == dict
+        except (json.JSONDecodeError, OSError):
+            return TimelineState()
+
+    return TimelineState(
+        newest_status_id=state["newest_status_id"],
+        posts=[ScoredPost.from_dict(post) for post in state["posts"]],
+        boosts=[ScoredPost.from_dict(post) for post in state["boosts"]],
+    )
+
+
+def save_timeline_state(state: TimelineState, config: Config) -> None:
+    with tempfile.NamedTemporaryFile(
+        "wb", prefix="mastodon_digest_timeline_state", suffix=".json.gz", delete=False
+    ) as f:
+        with gzip.open(f, "wt") as gz:
+            json.dump(
+                {
+                    "newest_status_id": state.newest_status_id,
+                    "saved_at": datetime.now(timezone.utc).isoformat(),
+                    "posts": [post.to_dict() for post in state.posts],
+                    "boosts": [post.to_dict() for post in state.boosts],
+                },
+                gz,
+            )
+        tempPath = f.name
+
+    shutil.move(tempPath, config.timeline_state_file)
+    print(f"Saved timeline state: {len(state.posts)} posts and {len(state.boosts)} boosts")
@@ -0,0 +1,41 @@
+from collections import defaultdict
+from typing import Hashable
+
+
+class UnionFind:
+    """Disjoint sets of keys, with path halving and union by size"""
+
+    def __init__(self) -> None:
+        self._parents: dict[Hashable, Hashable] = {}
+        self._sizes: dict[Hashable, int] = {}
+
+    def find(self, key: Hashable) -> Hashable:
+        if key not in self._parents:
+            self._parents[key] = key
+            self._sizes[key] = 1
+            return key
+
+        # path halving: point every other node on the way at its grandparent
+        parents = self._parents
+        while parents[key] != key:
+            parents[key] = parents[parents[key]]
+            key = parents[key]
+        return key
+
+    def union(self, key: Hashable, other_key: Hashable) -> None:
+        root = self.find(key)
+        other_root = self.find(other_key)
+        if root == other_root:
+            return
+
+        # union by size keeps the trees shallow
+        if self._sizes[root] < self._sizes[other_root]:
+            root, other_root = other_root, root
+        self._parents[other_root] = root
+        self._sizes[root] += self._sizes.pop(other_root)
+
+    def groups(self) -> list[set[Hashable]]:
+        groups: defaultdict[Hashable, set[Hashable]] = defaultdict(set)
+        for key in self._parents:
+            groups[self.find(key)].add(key)
+        return list(groups.values())